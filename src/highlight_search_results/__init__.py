@@ -42,10 +42,16 @@ def initialize_addon():
     from .consts import ADDON
     from .libaddon.consts import set_addon_properties
     from .browser import initialize_browser
+    from .changes import initialize_changes
+    from .previewer import initialize_previewer
+    from .webview import initialize_webview
 
     set_addon_properties(ADDON)
 
+    initialize_changes()
     initialize_browser()
+    initialize_previewer()
+    initialize_webview()
 
 
 if not os.getenv("PYTEST_ANKI_SKIP_ADDON_INIT"):
@@ -29,21 +29,58 @@
 #
 # Any modifications to this file must keep this entire header intact.
 
-import unicodedata
-from typing import List, Optional
+from typing import Callable, List, Optional, Sequence, Tuple
 
 from aqt.browser import Browser
-from aqt.qt import QKeySequence, QShortcut, QMenu
-
+from aqt.errors import show_exception
+from aqt.operations import QueryOp
+from aqt.qt import (
+    QItemSelection,
+    QItemSelectionModel,
+    QKeySequence,
+    QMenu,
+    QShortcut,
+)
+
+from .changes import collection_changes
 from .config import config
-from .search import SearchTokenizer, QueryLanguageVersion
+from .matches import (
+    MatchList,
+    MatchListCache,
+    find_next_row,
+    merge_ranges,
+    rows_to_ranges,
+)
+from .scheduler import HighlightScheduler
+from .search import QueryLanguageVersion, SearchTerm
+from .service import highlight_service
+from .table import TableHighlightDelegate
 from .webview import clear_highlights, highlight_terms
 
 _SEARCH_PLACEHOLDER: Optional[str]
 _SEARCH_PLACEHOLDER = None
-_query_language_version = QueryLanguageVersion.ANKI2124
 
-_search_tokenizer = SearchTokenizer(_query_language_version)
+_match_list_cache = MatchListCache()
+collection_changes.register(_match_list_cache.clear)
+
+
+def set_query_language_version(query_language_version: QueryLanguageVersion):
+    """Swap out the search tokenizer, invalidating all cached search terms"""
+    highlight_service.query_language_version = query_language_version
+
+
+def register_ignored_search_prefix(prefix: str):
+    """
+    Exclude search terms with the given prefix (e.g. "myaddon:") from
+    highlighting. Intended to be used by add-ons extending the search syntax.
+
+    Arguments:
+        prefix {str} -- Search prefix, with or without trailing colon
+
+    Raises:
+        ValueError -- If the prefix is invalid
+    """
+    highlight_service.register_ignored_search_prefix(prefix)
 
 
 def on_browser_did_change_row(
@@ -55,65 +92,257 @@ def on_browser_did_change_row(
     if not hasattr(browser, "_highlight_results") or not browser._highlight_results:
         return
 
-    search_text = browser.form.searchEdit.lineEdit().text()
+    scheduler: Optional[HighlightScheduler] = getattr(
+        browser, "_highlight_scheduler", None
+    )
 
-    search_text = unicodedata.normalize("NFC", search_text)
+    if scheduler is None:
+        _highlight_search_results(browser)
+    else:
+        # only highlight the row that ends up current after a burst of changes
+        scheduler.schedule()
 
-    if not search_text or search_text == _SEARCH_PLACEHOLDER:
+
+def on_browser_did_search(browser: Browser, search_text: Optional[str] = None):
+    """
+    Parse each search once, and share its terms with all highlighted views
+    """
+    if search_text is None:
+        search_text = browser.form.searchEdit.lineEdit().text()
+    if search_text == _SEARCH_PLACEHOLDER:
+        search_text = ""
+    # kept around for when highlights are toggled back on
+    browser._highlight_search = search_text
+    if getattr(browser, "_highlight_results", False):
+        highlight_service.set_search(search_text)
+
+
+def _on_search_terms_changed(browser: Browser, terms: Tuple[SearchTerm, ...]):
+    browser.form.tableView.viewport().update()
+    if terms:
+        on_browser_did_change_row(browser)
+    else:
+        _cancel_pending_highlights(browser)
+        clear_highlights(browser.editor.web)
+
+
+def _highlight_search_results(browser: Browser):
+    if not browser._highlight_results:
         return
 
-    tokens = _search_tokenizer.tokenize(search_text)
-    searchable_tokens = _search_tokenizer.get_searchable_tokens(tokens)
+    searchable_terms = highlight_service.terms
 
-    if not searchable_tokens:
+    if not searchable_terms:
+        # also cancels highlighting still in progress for the previous row
+        clear_highlights(browser.editor.web)
         return
 
-    highlight_terms(browser.editor.web, searchable_tokens)
+    note = browser.editor.note
+    field_names = note.keys() if note else []
+
+    highlight_terms(browser.editor.web, searchable_terms, field_names)
 
 
 def select_all_matching_cards(browser: Browser):
-    matching_cids = _find_from_search_entry(browser)
-    _set_card_selection(browser, matching_cids)
+    _find_from_search_entry(
+        browser, lambda matching_ids: _set_item_selection(browser, matching_ids)
+    )
 
 
 def select_next_matching_card(browser: Browser):
-    matching_cids = _find_from_search_entry(browser)
+    _find_from_search_entry(
+        browser, lambda matching_ids: _select_next_match(browser, matching_ids)
+    )
 
-    current_cid: Optional[int] = None if not browser.card else browser.card.id
 
-    # jump to next card, while wrapping around at the end
+def _select_next_match(browser: Browser, matching_ids: MatchList):
+    item_ids = _get_table_item_ids(browser)
+    current_row = browser.form.tableView.currentIndex().row()
 
-    if current_cid and current_cid in matching_cids:
-        next_index = matching_cids.index(current_cid) + 1
-    else:
-        next_index = None
+    # walk the table's own row order, while wrapping around at the end
+    next_row = find_next_row(item_ids, current_row, matching_ids)
 
-    if next_index is None or next_index >= len(matching_cids):
-        next_index = 0
+    if next_row is None:
+        return
 
-    next_cid = matching_cids[next_index]
+    _select_row_ranges(browser, [(next_row, next_row)], next_row)
 
-    _set_card_selection(browser, [next_cid])
 
+def _is_notes_mode(browser: Browser) -> bool:
+    try:
+        # Anki 2.1.45+
+        return browser.table.is_notes_mode()
+    except AttributeError:
+        return False
 
-def _find_from_search_entry(browser: Browser):
+
+def _find_from_search_entry(
+    browser: Browser, on_found: Callable[[MatchList], None]
+) -> None:
+    """
+    Search the collection for the contents of the search entry in the
+    background, and call on_found with the matches once the search is done
+
+    Matches are note ids if the Browser shows notes, and card ids otherwise,
+    just like the items of the Browser table. Only the most recent request
+    is answered, so that a quick succession of hotkey presses does not act
+    on stale results. Presses repeating the search that is still running do
+    not start another one, but are answered by the running search.
+    """
     search_text = browser.form.searchEdit.lineEdit().text().strip()
-    return list(browser.col.findCards(search_text, order=True))
+    notes_mode = _is_notes_mode(browser)
+    collection_generation = collection_changes.generation
+
+    # results of searches started before a change to the collection are
+    # never looked up again
+    cache_key = (search_text, notes_mode, collection_generation)
+
+    browser._find_generation = generation = browser._find_generation + 1
+    browser._find_request = (generation, cache_key, on_found)
+
+    matching_ids = _match_list_cache.get(cache_key)
+    if matching_ids is not None:
+        on_found(matching_ids)
+        return
+
+    if browser._find_pending_key == cache_key:
+        return
+    browser._find_pending_key = cache_key
+
+    def on_success(item_ids: Sequence[int]):
+        if browser._find_pending_key == cache_key:
+            browser._find_pending_key = None
+        matching_ids = MatchList(item_ids)
+        if collection_generation == collection_changes.generation:
+            # still valid for the next request, even if this one was superseded
+            _match_list_cache.put(cache_key, matching_ids)
+        # answer the most recent request, if it is for the same search
+        latest_generation, latest_key, latest_on_found = browser._find_request
+        if latest_generation == browser._find_generation and latest_key == cache_key:
+            latest_on_found(matching_ids)
+
+    def on_failure(exception: Exception):
+        if browser._find_pending_key == cache_key:
+            browser._find_pending_key = None
+        show_exception(parent=browser, exception=exception)
+
+    # unordered, as matches are stepped through in the table's order
+    def find_matches(col) -> Sequence[int]:
+        if notes_mode:
+            return col.findNotes(search_text)
+        return col.findCards(search_text)
+
+    QueryOp(parent=browser, op=find_matches, success=on_success).failure(
+        on_failure
+    ).with_progress(
+        "Searching for matching {}...".format("notes" if notes_mode else "cards")
+    ).run_in_background()
+
+
+def _get_table_item_ids(browser: Browser) -> Sequence[int]:
+    """Return the ids of all items in the Browser table, in row order"""
+    try:
+        # Anki 2.1.45+
+        return browser.table._model._items
+    except AttributeError:
+        return browser.model.cards
+
+
+def _get_table_item_id(browser: Browser, row: int) -> Optional[int]:
+    item_ids = _get_table_item_ids(browser)
+    if 0 <= row < len(item_ids):
+        return item_ids[row]
+    return None
+
+
+def _get_table_column_key(browser: Browser, column: int) -> Optional[str]:
+    try:
+        # Anki 2.1.45+
+        return browser.table._state.column_key_at(column)
+    except AttributeError:
+        pass
+    try:
+        return browser.model.activeCols[column]
+    except (AttributeError, IndexError):
+        return None
+
+
+def _setup_table_highlights(browser: Browser):
+    table_view = browser.form.tableView
+    browser._highlight_delegate = TableHighlightDelegate(
+        table_view,
+        # wrapped, so that e.g. row colors keep being painted
+        table_view.itemDelegate(),
+        lambda: highlight_service.terms,
+        lambda row: _get_table_item_id(browser, row),
+        lambda column: _get_table_column_key(browser, column),
+    )
+    table_view.setItemDelegate(browser._highlight_delegate)
+
+
+def _get_selected_row_ranges(selection_model) -> List[Tuple[int, int]]:
+    return merge_ranges(
+        (selection_range.top(), selection_range.bottom())
+        for selection_range in selection_model.selection()
+    )
+
+
+def _set_item_selection(browser: Browser, item_ids: MatchList):
+    selection_model = browser.form.tableView.selectionModel()
+
+    rows = item_ids.rows_in(_get_table_item_ids(browser))
+    row_ranges = rows_to_ranges(rows)
+
+    if row_ranges == _get_selected_row_ranges(selection_model):
+        return
+
+    _select_row_ranges(browser, row_ranges, rows[0] if rows else None)
+
+
+def _select_row_ranges(
+    browser: Browser, row_ranges: List[Tuple[int, int]], current_row: Optional[int]
+):
+    """
+    Select the inclusive (top, bottom) ranges of rows in the Browser table,
+    replacing the current selection, and scroll to current_row
+    """
+    table_view = browser.form.tableView
+    model = table_view.model()
+    selection_model = table_view.selectionModel()
+
+    last_column = model.columnCount() - 1
+    selection = QItemSelection()
+    for top, bottom in row_ranges:
+        selection.select(model.index(top, 0), model.index(bottom, last_column))
+
+    selection_model.select(
+        selection, QItemSelectionModel.ClearAndSelect | QItemSelectionModel.Rows
+    )
+
+    if current_row is None:
+        return
+
+    current_index = model.index(current_row, 0)
+    selection_model.setCurrentIndex(current_index, QItemSelectionModel.NoUpdate)
+    table_view.scrollTo(current_index)
 
 
-def _set_card_selection(browser: Browser, cids: List[int]):
-    browser.form.tableView.selectionModel().clear()
-    browser.model.selectedCards = {cid: True for cid in cids}
-    browser.model.restoreSelection()
+def _cancel_pending_highlights(browser: Browser):
+    scheduler: Optional[HighlightScheduler] = getattr(
+        browser, "_highlight_scheduler", None
+    )
+    if scheduler is not None:
+        scheduler.cancel()
 
 
 def toggle_search_highlights(browser: Browser, checked: bool):
     """Toggle search highlights on or off"""
     browser._highlight_results = checked
-    if not checked:
-        clear_highlights(browser.editor.web)
+    # views are updated by their subscriptions to the service
+    if checked:
+        highlight_service.set_search(browser._highlight_search)
     else:
-        on_browser_did_change_row(browser)
+        highlight_service.clear()
 
 
 def on_browser_will_show(browser: Browser):
@@ -135,9 +364,39 @@ def on_browser_will_show(browser: Browser):
     )
 
 
+def on_browser_will_close(browser: Browser):
+    _cancel_pending_highlights(browser)
+    # drop the results of searches still running in the background
+    browser._find_generation += 1
+    highlight_service.unsubscribe(browser._on_search_terms_changed)
+    highlight_service.clear()
+
+
 def on_browser_menus_did_init(browser: Browser):
     """Setup menu entries and hotkeys"""
+    for prefix in config["local"]["ignored_search_prefixes"]:
+        register_ignored_search_prefix(prefix)
+
     browser._highlight_results = config["local"]["highlight_by_default"]
+    # incremented by each search for matching cards
+    browser._find_generation = 0
+    # generation, cache key, and callback of the most recent search
+    browser._find_request = None
+    # cache key of the search running in the background, if any
+    browser._find_pending_key = None
+    browser._highlight_scheduler = HighlightScheduler(
+        browser,
+        lambda: _highlight_search_results(browser),
+        config["local"]["highlight_delay"],
+    )
+    _setup_table_highlights(browser)
+
+    browser._on_search_terms_changed = lambda terms: _on_search_terms_changed(
+        browser, terms
+    )
+    highlight_service.subscribe(browser._on_search_terms_changed)
+    # picks up the initial search, if the Browser already ran it
+    on_browser_did_search(browser)
 
     try:
         # used by multiple add-ons, so we check for its existence first
@@ -179,6 +438,21 @@ def initialize_browser():
             Browser._onRowChanged, on_browser_did_change_row, "after"
         )
 
+    try:
+        from aqt.gui_hooks import browser_did_search
+
+        browser_did_search.append(
+            lambda context: on_browser_did_search(context.browser, context.search)
+        )
+    except (ImportError, ModuleNotFoundError):
+        from anki.hooks import wrap
+
+        Browser.search = wrap(Browser.search, on_browser_did_search, "after")
+
+    from anki.hooks import wrap
+
+    Browser._closeWindow = wrap(Browser._closeWindow, on_browser_will_close, "before")
+
     try:
         from aqt.gui_hooks import browser_will_show
 
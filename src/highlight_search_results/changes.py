@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+# Highlight Search Results in the Browser Add-on for Anki
+#
+# Copyright (C) 2017-2020  Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+"""
+Tracks changes to the collection, so that caches of search results know
+when they have gone stale
+"""
+
+from typing import Any, Callable, List, Optional
+
+# kinds of changes reported by operations that can affect search results
+_SEARCH_AFFECTING_CHANGES = ("browser_table", "note_text", "card")
+
+
+class CollectionChanges:
+    """
+    Monotonically increasing generation counter of the collection's
+    contents, bumped on every change that could affect search results
+
+    Caches can either include the current generation in their keys, or
+    register a callback to be cleared whenever the collection changes.
+    """
+
+    def __init__(self):
+        self._generation = 0
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def register(self, callback: Callable[[], None]):
+        """Call callback (e.g. the clear method of a cache) on every change"""
+        if callback not in self._callbacks:
+            self._callbacks.append(callback)
+
+    def unregister(self, callback: Callable[[], None]):
+        try:
+            self._callbacks.remove(callback)
+        except ValueError:
+            pass
+
+    def invalidate(self):
+        """Record a change to the collection"""
+        self._generation += 1
+        for callback in list(self._callbacks):
+            callback()
+
+
+collection_changes = CollectionChanges()
+
+
+def on_operation_did_execute(changes: Any, handler: Optional[object]):
+    # kinds of changes missing from older versions are assumed to be present
+    if any(getattr(changes, kind, True) for kind in _SEARCH_AFFECTING_CHANGES):
+        collection_changes.invalidate()
+
+
+def on_collection_changed(*args: Any):
+    collection_changes.invalidate()
+
+
+def initialize_changes():
+    from aqt import gui_hooks
+
+    gui_hooks.operation_did_execute.append(on_operation_did_execute)
+    # changes made outside of undoable operations
+    gui_hooks.reviewer_did_answer_card.append(on_collection_changed)
+    gui_hooks.add_cards_did_add_note.append(on_collection_changed)
+    gui_hooks.sync_did_finish.append(on_collection_changed)
+    gui_hooks.collection_did_load.append(on_collection_changed)
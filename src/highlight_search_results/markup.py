@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+# Highlight Search Results in the Browser Add-on for Anki
+#
+# Copyright (C) 2017-2020  Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+"""
+Handling of the highlight markup in field HTML
+"""
+
+import re
+from typing import List
+
+_SPAN_TAG = re.compile(r"<(/?)span\b[^>]*>", re.IGNORECASE)
+_MARK_CLASS = re.compile(r"""\bclass=["']?hsr-highlight\b""", re.IGNORECASE)
+
+
+def strip_highlights(html: str) -> str:
+    """
+    Remove highlight markers from field HTML, keeping their contents
+
+    Markers can end up containing markup of their own (e.g. when a letter of
+    a highlighted word is colored), so each marker's closing tag is found by
+    keeping track of the nesting of span elements.
+    """
+    if "hsr-highlight" not in html:
+        return html
+
+    pieces: List[str] = []
+    position = 0
+    # for each open span element, whether it is a highlight marker
+    open_spans: List[bool] = []
+
+    for match in _SPAN_TAG.finditer(html):
+        if match.group(1):
+            if not open_spans or not open_spans.pop():
+                continue
+        else:
+            is_mark = _MARK_CLASS.search(match.group()) is not None
+            open_spans.append(is_mark)
+            if not is_mark:
+                continue
+        pieces.append(html[position : match.start()])
+        position = match.end()
+
+    pieces.append(html[position:])
+    return "".join(pieces)
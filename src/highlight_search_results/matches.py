@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+
+# Highlight Search Results in the Browser Add-on for Anki
+#
+# Copyright (C) 2017-2020  Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+"""
+Caching of search results used to navigate between matching items, and of
+the spans search terms match in the text of those items
+"""
+
+import re
+import unicodedata
+from array import array
+from collections import OrderedDict
+from functools import lru_cache
+from typing import (
+    Container,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Pattern,
+    Sequence,
+    Tuple,
+)
+
+from .search import SearchTerm, SearchTermKind
+
+#: (start, end) offsets of a match in a piece of text
+Span = Tuple[int, int]
+
+
+class MatchList:
+    """
+    Ordered ids of the items matching a search
+
+    Ids are kept in a compact array in search order, along with their
+    positions sorted by id, so that an item's position can be looked up by
+    binary search. This takes 12 bytes per item, compared to over 100 bytes
+    for a list of ints indexed by a dict.
+    """
+
+    def __init__(self, item_ids: Iterable[int]):
+        self._item_ids = array("q", item_ids)
+        # positions in search order, ordered by the ids at these positions
+        self._positions_by_id = array(
+            "I", sorted(range(len(self._item_ids)), key=self._item_ids.__getitem__)
+        )
+
+    def __len__(self) -> int:
+        return len(self._item_ids)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._item_ids)
+
+    def __contains__(self, item_id: object) -> bool:
+        return isinstance(item_id, int) and self.position(item_id) is not None
+
+    def __getitem__(self, position: int) -> int:
+        return self._item_ids[position]
+
+    def position(self, item_id: int) -> Optional[int]:
+        item_ids = self._item_ids
+        positions = self._positions_by_id
+        low, high = 0, len(positions)
+        while low < high:
+            middle = (low + high) // 2
+            if item_ids[positions[middle]] < item_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(positions) and item_ids[positions[low]] == item_id:
+            return positions[low]
+        return None
+
+    def rows_in(self, row_item_ids: Iterable[int]) -> List[int]:
+        """
+        Return the rows of row_item_ids (e.g. the items in a table) that are
+        part of the list, in ascending order
+        """
+        # a throwaway set is an order of magnitude faster than looking up
+        # each row by binary search, and is not kept around
+        matches = set(self._item_ids)
+        return [row for row, item_id in enumerate(row_item_ids) if item_id in matches]
+
+
+class MatchListCache:
+    """
+    Holds on to the match list of the most recent search
+
+    Callers are responsible for choosing a key that changes whenever the
+    search results might (e.g. search text and collection generation)
+    """
+
+    def __init__(self):
+        self._key: Optional[Hashable] = None
+        self._matches: Optional[MatchList] = None
+
+    def get(self, key: Hashable) -> Optional[MatchList]:
+        if self._matches is None or key != self._key:
+            return None
+        return self._matches
+
+    def put(self, key: Hashable, matches: MatchList):
+        self._key = key
+        self._matches = matches
+
+    def clear(self):
+        self._key = None
+        self._matches = None
+
+
+def merge_ranges(ranges: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Merge overlapping or adjacent inclusive (top, bottom) ranges"""
+    merged: List[Tuple[int, int]] = []
+
+    for top, bottom in sorted(ranges):
+        if merged and top <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], bottom))
+        else:
+            merged.append((top, bottom))
+
+    return merged
+
+
+def rows_to_ranges(rows: Iterable[int]) -> List[Tuple[int, int]]:
+    """
+    Collapse row indices into sorted, inclusive (top, bottom) ranges of
+    contiguous rows
+    """
+    return merge_ranges((row, row) for row in rows)
+
+
+def find_next_row(
+    row_item_ids: Sequence[int], current_row: int, matches: Container[int]
+) -> Optional[int]:
+    """
+    Return the first row after current_row whose item is among matches,
+    wrapping around at the end, or None if there is no such row
+
+    Only the rows up to the next match are looked at. Pass a current_row of
+    -1 to start from the first row.
+    """
+    count = len(row_item_ids)
+    for offset in range(1, count + 1):
+        row = (current_row + offset) % count
+        if row_item_ids[row] in matches:
+            return row
+    return None
+
+
+def fold_text(text: str) -> Tuple[str, Optional[List[int]], Optional[List[int]]]:
+    """
+    Decompose text (NFD) like the editor's highlighter does, returning the
+    decomposed text along with the start and end offsets in text that each
+    of its characters originates from, or None offsets if text was
+    decomposed already
+    """
+    if unicodedata.normalize("NFD", text) == text:
+        return text, None, None
+
+    # decomposing character by character keeps the offsets aligned
+    parts: List[str] = []
+    starts: List[int] = []
+    ends: List[int] = []
+    for offset, character in enumerate(text):
+        decomposed = unicodedata.normalize("NFD", character)
+        parts.append(decomposed)
+        starts.extend([offset] * len(decomposed))
+        ends.extend([offset + 1] * len(decomposed))
+
+    return "".join(parts), starts, ends
+
+
+@lru_cache(maxsize=16)
+def compile_terms(terms: Tuple[SearchTerm, ...]) -> Optional[Pattern]:
+    """
+    Combine the plain text search terms that are not limited to a field into
+    a single pattern matching decomposed text, equivalent to the one built by
+    the editor's highlighter
+
+    Regular expression terms (including translated wildcards) are left out.
+    Python's re module cannot bound the time they take to match, and table
+    cells are matched while they are painted.
+
+    Returns None if there are no such terms.
+    """
+    literals = sorted(
+        (
+            unicodedata.normalize("NFD", term.text)
+            for term in terms
+            if term.field is None and term.kind == SearchTermKind.TEXT
+        ),
+        # prefer longer matches for terms sharing a prefix
+        key=len,
+        reverse=True,
+    )
+    if not literals:
+        return None
+
+    return re.compile("|".join(map(re.escape, literals)), re.IGNORECASE)
+
+
+def _is_mark(character: str) -> bool:
+    # same as \p{M} in the highlighter's patterns
+    return unicodedata.category(character)[0] == "M"
+
+
+def find_match_spans(pattern: Pattern, text: str) -> Tuple[Span, ...]:
+    """
+    Return the non-overlapping spans of text that pattern matches, never
+    ending a match in the middle of an accented character
+    """
+    folded, starts, ends = fold_text(text)
+    spans: List[Span] = []
+    last_end = 0
+    position = 0
+
+    while True:
+        match = pattern.search(folded, position)
+        if match is None:
+            break
+        position = match.start() + 1
+        while match is not None and match.end() < len(folded):
+            if not _is_mark(folded[match.end()]):
+                break
+            # like the highlighter's lookahead, fall back to shorter terms
+            # matching at the same offset
+            match = pattern.match(folded, match.start(), match.end() - 1)
+        if match is None or match.start() == match.end():
+            continue
+        position = match.end()
+
+        if starts is None or ends is None:
+            start, end = match.span()
+        else:
+            start, end = starts[match.start()], ends[match.end() - 1]
+        if start < last_end:
+            # starts within a character that is highlighted already
+            continue
+        spans.append((start, end))
+        last_end = end
+
+    return tuple(spans)
+
+
+class MatchSpanCache:
+    """
+    Bounded LRU cache of the spans that search terms match in the text of
+    items (e.g. the cells of the Browser table)
+
+    Spans are only computed when first requested, i.e. for the items that
+    are actually displayed. Entries remember the text their spans were
+    found in, so that edits to an item are picked up without having to
+    invalidate the cache.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self._maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, Tuple[str, Tuple[Span, ...]]]"
+        self._entries = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get_spans(
+        self, key: Hashable, text: str, pattern: Pattern
+    ) -> Tuple[Span, ...]:
+        """
+        Arguments:
+            key {Hashable} -- Identifies the item and the search, e.g.
+                              (item id, column, search terms)
+            text {str} -- Current text of the item
+            pattern {Pattern} -- Pattern of the search, as returned by
+                                 compile_terms
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == text:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+
+        self.misses += 1
+
+        spans = find_match_spans(pattern, text)
+
+        self._entries[key] = (text, spans)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+        return spans
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# Highlight Search Results in the Browser Add-on for Anki
+#
+# Copyright (C) 2017-2020  Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+"""
+Highlights the current search in card previewers
+"""
+
+from typing import Tuple
+
+from anki.cards import Card
+
+from .search import SearchTerm
+from .service import highlight_service
+from .webview import clear_highlights, highlight_script, highlight_terms
+
+try:
+    # Anki 2.1.45+
+    from aqt.browser.previewer import Previewer
+except (ImportError, ModuleNotFoundError):
+    from aqt.previewer import Previewer
+
+_PREVIEW_KINDS = ("previewQuestion", "previewAnswer")
+
+
+def _highlight_previewer(previewer: Previewer, terms: Tuple[SearchTerm, ...]):
+    webview = getattr(previewer, "_web", None)
+    card = previewer.card()
+    if webview is None or card is None:
+        return
+    if not terms:
+        clear_highlights(webview)
+        return
+    highlight_terms(webview, terms, card.note().keys(), scope="document")
+
+
+def on_previewer_did_init(previewer: Previewer):
+    """Keep highlights in sync with searches made while the previewer is open"""
+
+    def on_terms_changed(terms: Tuple[SearchTerm, ...]):
+        _highlight_previewer(previewer, terms)
+
+    highlight_service.subscribe(on_terms_changed)
+    previewer.finished.connect(  # type: ignore
+        lambda *args: highlight_service.unsubscribe(on_terms_changed)
+    )
+
+
+def on_card_will_show(text: str, card: Card, kind: str) -> str:
+    """
+    Highlight the card once the previewer has finished rendering it, so that
+    e.g. math is already typeset
+    """
+    terms = highlight_service.terms
+    if kind not in _PREVIEW_KINDS or not terms:
+        return text
+    script = highlight_script(terms, card.note().keys())
+    # search text must not be able to end the script element early
+    script = script.replace("</", "<\\/")
+    return "{}<script>onShownHook.push(function () {{ {} }});</script>".format(
+        text, script
+    )
+
+
+def initialize_previewer():
+    from aqt.gui_hooks import card_will_show, previewer_did_init
+
+    previewer_did_init.append(on_previewer_did_init)
+    card_will_show.append(on_card_will_show)
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+
+# Highlight Search Results in the Browser Add-on for Anki
+#
+# Copyright (C) 2017-2020  Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+"""
+Parsing of search queries into syntax trees, and the search terms to
+highlight that are derived from them
+"""
+
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+
+from .search import (
+    QueryLanguageVersion,
+    SearchTerm,
+    SearchToken,
+    SearchTokenizer,
+    TokenKind,
+)
+
+_OR_OPERATORS = frozenset(("or", "OR"))
+
+# deeper nesting is flattened, keeping recursion within Python's limits
+_MAX_DEPTH = 100
+
+
+class QueryNode:
+    """Node of the syntax tree of a search query"""
+
+    __slots__ = ()
+
+
+@dataclass(frozen=True)
+class TermNode(QueryNode):
+    """Search term, optionally limited to a field (e.g. "front:dog")"""
+
+    token: SearchToken
+
+    @property
+    def field(self) -> Optional[str]:
+        return self.token.field
+
+
+@dataclass(frozen=True)
+class NotNode(QueryNode):
+    child: QueryNode
+
+
+@dataclass(frozen=True)
+class AndNode(QueryNode):
+    children: Tuple[QueryNode, ...]
+
+
+@dataclass(frozen=True)
+class OrNode(QueryNode):
+    children: Tuple[QueryNode, ...]
+
+
+class _Parser:
+    """
+    Recursive descent parser for the tokens of a single query
+
+    Like Anki, terms are implicitly joined by "and", which binds tighter than
+    "or", and "-" negates the term or group that follows it. Malformed input
+    (e.g. unbalanced parentheses) is parsed as leniently as possible rather
+    than rejected.
+    """
+
+    def __init__(self, tokens: List[SearchToken]):
+        self._tokens = tokens
+        self._position = 0
+
+    def parse(self) -> QueryNode:
+        return self._parse_or(0)
+
+    def _peek(self) -> Optional[SearchToken]:
+        if self._position < len(self._tokens):
+            return self._tokens[self._position]
+        return None
+
+    def _parse_or(self, depth: int) -> QueryNode:
+        children = [self._parse_and(depth)]
+
+        token = self._peek()
+        while (
+            token is not None
+            and token.kind == TokenKind.OPERATOR
+            and token.text in _OR_OPERATORS
+        ):
+            self._position += 1
+            children.append(self._parse_and(depth))
+            token = self._peek()
+
+        return children[0] if len(children) == 1 else OrNode(tuple(children))
+
+    def _parse_and(self, depth: int) -> QueryNode:
+        children: List[QueryNode] = []
+        tokens = self._tokens
+
+        while self._position < len(tokens):
+            token = tokens[self._position]
+            if token.kind is TokenKind.TERM:
+                # by far the most common case, handled without descending
+                self._position += 1
+                children.append(TermNode(token))
+                continue
+            if token.kind == TokenKind.PAREN and token.text == ")":
+                if depth > 0:
+                    # closes the group, consumed by _parse_unary
+                    break
+                # unbalanced
+                self._position += 1
+                continue
+            if token.kind == TokenKind.OPERATOR:
+                if token.text in _OR_OPERATORS:
+                    break
+                # "and", as well as operators registered by other add-ons
+                self._position += 1
+                continue
+            node = self._parse_unary(depth)
+            if node is not None:
+                children.append(node)
+
+        return children[0] if len(children) == 1 else AndNode(tuple(children))
+
+    def _parse_unary(self, depth: int) -> Optional[QueryNode]:
+        token = self._peek()
+        if token is None:
+            return None
+
+        if token.kind == TokenKind.NEGATION:
+            self._position += 1
+            child = self._parse_unary(depth)
+            return None if child is None else NotNode(child)
+
+        if token.kind == TokenKind.PAREN and token.text == "(":
+            self._position += 1
+            if depth >= _MAX_DEPTH:
+                return None
+            node = self._parse_or(depth + 1)
+            closing = self._peek()
+            if closing is not None and closing.text == ")":
+                self._position += 1
+            return node
+
+        if token.kind == TokenKind.TERM:
+            self._position += 1
+            return TermNode(token)
+
+        # nothing left to negate, e.g. in "-)" or "- or"
+        return None
+
+
+def parse_query(tokenizer: SearchTokenizer, query: str) -> QueryNode:
+    """Parse query into its syntax tree"""
+    return _Parser(tokenizer.scan(query)).parse()
+
+
+def iter_terms(node: QueryNode, negated: bool = False) -> Iterator[TermNode]:
+    """
+    Yield the term nodes of a syntax tree in query order, skipping terms
+    that are negated (unless negated again, as in "-(-a)")
+    """
+    if isinstance(node, TermNode):
+        if not negated:
+            yield node
+    elif isinstance(node, NotNode):
+        yield from iter_terms(node.child, not negated)
+    elif isinstance(node, (AndNode, OrNode)):
+        for child in node.children:
+            yield from iter_terms(child, negated)
+
+
+class QueryParser:
+    """
+    Parses search queries into syntax trees, caching the trees of the most
+    recently parsed queries
+
+    Like SearchTermsCache, the cache is cleared whenever the tokenizer or its
+    rules change.
+    """
+
+    def __init__(self, tokenizer: SearchTokenizer, maxsize: int = 64):
+        self._tokenizer = tokenizer
+        self._maxsize = maxsize
+        self._trees: "OrderedDict[str, QueryNode]" = OrderedDict()
+        self._tokenizer_revision = tokenizer.revision
+        self.hits: int = 0
+        self.misses: int = 0
+
+    @property
+    def tokenizer(self) -> SearchTokenizer:
+        return self._tokenizer
+
+    @tokenizer.setter
+    def tokenizer(self, tokenizer: SearchTokenizer):
+        self._tokenizer = tokenizer
+        self.clear()
+
+    def parse(self, query: str) -> QueryNode:
+        if self._tokenizer_revision != self._tokenizer.revision:
+            self.clear()
+
+        try:
+            tree = self._trees[query]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            self._trees.move_to_end(query)
+            return tree
+
+        self.misses += 1
+
+        tree = parse_query(self._tokenizer, query)
+
+        self._trees[query] = tree
+        if len(self._trees) > self._maxsize:
+            self._trees.popitem(last=False)
+
+        return tree
+
+    def clear(self):
+        self._trees.clear()
+        self._tokenizer_revision = self._tokenizer.revision
+
+    def __len__(self) -> int:
+        return len(self._trees)
+
+
+_TermsCacheKey = Tuple[str, QueryLanguageVersion]
+
+
+class SearchTermsCache:
+    """
+    Bounded LRU cache mapping raw search text to the terms that should be
+    highlighted for it
+
+    Entries are keyed on the raw (unnormalized) search text and the query
+    language version of the tokenizer, so that repeated lookups of an
+    unchanged search skip normalization, parsing, and filtering
+    altogether. Assigning a new tokenizer, or changing the rules of the
+    current one, clears the cache.
+
+    Terms are taken from the query's syntax tree, leaving out negated terms
+    (e.g. "two" in "one -two") and operators.
+    """
+
+    def __init__(self, tokenizer: SearchTokenizer, maxsize: int = 64):
+        self._parser = QueryParser(tokenizer, maxsize)
+        self._maxsize = maxsize
+        self._entries: "OrderedDict[_TermsCacheKey, Tuple[SearchTerm, ...]]"
+        self._entries = OrderedDict()
+        self._tokenizer_revision = tokenizer.revision
+        self.hits: int = 0
+        self.misses: int = 0
+
+    @property
+    def parser(self) -> QueryParser:
+        return self._parser
+
+    @property
+    def tokenizer(self) -> SearchTokenizer:
+        return self._parser.tokenizer
+
+    @tokenizer.setter
+    def tokenizer(self, tokenizer: SearchTokenizer):
+        self._parser.tokenizer = tokenizer
+        self.clear()
+
+    def get_terms(self, search_text: str) -> Tuple[SearchTerm, ...]:
+        tokenizer = self._parser.tokenizer
+
+        if self._tokenizer_revision != tokenizer.revision:
+            # tokenizer rules changed since the cached terms were computed
+            self.clear()
+
+        key = (search_text, tokenizer.query_language_version)
+
+        try:
+            terms = self._entries[key]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return terms
+
+        self.misses += 1
+
+        normalized_text = unicodedata.normalize("NFC", search_text)
+        tree = self._parser.parse(normalized_text)
+        terms = tuple(
+            tokenizer.get_searchable_terms([node.token for node in iter_terms(tree)])
+        )
+
+        self._entries[key] = terms
+        if len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+        return terms
+
+    def clear(self):
+        self._entries.clear()
+        self._tokenizer_revision = self._parser.tokenizer.revision
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,505 @@
+# -*- coding: utf-8 -*-
+
+# Highlight Search Results in the Browser Add-on for Anki
+#
+# Copyright (C) 2017-2020  Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+"""
+Translation of regular expression searches (re:) and wildcard searches into
+patterns the editor's highlighter can run
+"""
+
+import re
+import unicodedata
+import warnings
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+try:
+    # Python 3.11+
+    from re import _parser as sre_parse  # type: ignore
+except ImportError:
+    import sre_parse  # type: ignore
+
+_REPEATS = tuple(
+    getattr(sre_parse, name)
+    for name in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT")
+    if hasattr(sre_parse, name)
+)
+_GROUP_REFERENCES = (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS)
+
+# Anki prepends this itself, and the highlighter is case-insensitive anyway
+_CASE_INSENSITIVE_FLAG = "(?i)"
+# inline flags other than a leading (?i) have no equivalent in JavaScript
+_INLINE_FLAGS = re.compile(r"\(\?[a-zA-Z-]+[):]")
+_NAMED_GROUP = re.compile(r"\(\?P?<(?=[a-zA-Z_])")
+_QUANTIFIERS = ("*", "+", "?", "{")
+
+# characters with a special meaning in JavaScript regular expressions. Unlike
+# re.escape, this leaves all other characters alone, as escaping them is an
+# error in unicode mode.
+_SPECIAL_CHARS = re.compile(r"[.*+?^${}()|[\]\\]")
+
+# Wildcards do not extend matches across whitespace, so highlights stay
+# confined to single words. The highlighter matches decomposed (NFD) text, so
+# "_" has to take in combining marks.
+_WILDCARDS = "*_"
+_ANY_CHARACTER = r"\S\p{M}*"
+_COMBINING_MARKS = r"\p{M}*"
+
+
+def escape_regex(text: str) -> str:
+    """Escape text for use in a JavaScript regular expression"""
+    return _SPECIAL_CHARS.sub(r"\\\g<0>", text)
+
+
+def strip_combining(text: str) -> str:
+    """Remove accents and other combining marks from text"""
+    return "".join(
+        c
+        for c in unicodedata.normalize("NFD", text)
+        if not unicodedata.combining(c)
+    )
+
+
+def _escape_ignoring_combining(text: str) -> str:
+    return "".join(escape_regex(c) + _COMBINING_MARKS for c in text)
+
+
+def _skip_to(first: str, unless: str) -> str:
+    # Matches the rest of a word up to the first place where the text following
+    # a "*" can match: its first character, unless the given lookaround fails
+    # there. A lazy \S*? would move on to later places whenever the rest of the
+    # term fails, which takes polynomial time on long words. Here each
+    # character can only be matched one way, so a failing step is given up as
+    # a whole.
+    if first.isspace():
+        return r"\S*"
+    excluded = r"[^\s%s]" % ("\\-" if first == "-" else escape_regex(first))
+    if not unless:
+        return excluded + "*"
+    return "(?:%s|%s%s)*" % (excluded, escape_regex(first), unless)
+
+
+_CATEGORIES = {
+    sre_parse.CATEGORY_DIGIT: re.compile(r"\d"),
+    sre_parse.CATEGORY_NOT_DIGIT: re.compile(r"\D"),
+    sre_parse.CATEGORY_SPACE: re.compile(r"\s"),
+    sre_parse.CATEGORY_NOT_SPACE: re.compile(r"\S"),
+    sre_parse.CATEGORY_WORD: re.compile(r"\w"),
+    sre_parse.CATEGORY_NOT_WORD: re.compile(r"\W"),
+}
+_ZERO_WIDTH = (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT)
+# characters standing in for the ones not named in a pattern when checking
+# whether two parts of it can match the same character
+_SAMPLE_CHARACTERS = frozenset(
+    [chr(code) for code in range(128)]
+    + list("\u00a0\u00e9\u00df\u0430\u0663\u4e2d")
+)
+# keeps the time taken by the check itself in bounds
+_MAX_PATTERN_LENGTH = 500
+
+
+def _matches_character(op, av, c: str) -> bool:
+    """Check whether a parsed character or set matches c, ignoring case"""
+    if op is sre_parse.LITERAL:
+        return c.lower() == chr(av).lower()
+    if op is sre_parse.NOT_LITERAL:
+        return c.lower() != chr(av).lower()
+    if op is sre_parse.ANY:
+        return c != "\n"
+    if op is sre_parse.RANGE:
+        return any(
+            av[0] <= ord(v) <= av[1]
+            for v in (c, c.lower(), c.upper())
+            if len(v) == 1
+        )
+    if op is sre_parse.CATEGORY:
+        category = _CATEGORIES.get(av)
+        return category is None or category.match(c) is not None
+    if op is sre_parse.IN:
+        negated = bool(av) and av[0][0] is sre_parse.NEGATE
+        items = av[1:] if negated else av
+        return negated != any(_matches_character(*item, c) for item in items)
+    return True
+
+
+def _characters_in(subpattern, characters: Set[str]) -> Set[str]:
+    """Collect the characters a parsed pattern refers to by name"""
+    for op, av in subpattern:
+        if op in (sre_parse.LITERAL, sre_parse.NOT_LITERAL):
+            characters.add(chr(av))
+        elif op is sre_parse.RANGE:
+            characters.update((chr(av[0]), chr(av[1])))
+        elif op is sre_parse.IN:
+            _characters_in(av, characters)
+        elif op in _REPEATS:
+            _characters_in(av[2], characters)
+        elif op is sre_parse.SUBPATTERN:
+            _characters_in(av[-1], characters)
+        elif op is sre_parse.BRANCH:
+            for item in av[1]:
+                _characters_in(item, characters)
+    return characters
+
+
+class _BacktrackingCheck:
+    """
+    Check a parsed pattern for constructs whose matching time can grow
+    exponentially, or polynomially with a high degree, in a backtracking
+    engine like the web view's, i.e. group references, and parts that could
+    each match the same character where the engine has to try every way of
+    splitting the text between them:
+
+    - repetitions, optional items, or alternatives nested in unbounded
+      repetitions (e.g. "(a+)+", "(a?a)+", or "(a|aa)+")
+    - variable-length items next to each other (e.g. ".*.*" or "a?a?")
+
+    Parts are compared by the characters they can start with, drawn from a
+    sample of characters that includes all the ones the pattern names.
+    """
+
+    def __init__(self, parsed):
+        self._state = parsed.state
+        self._universe = frozenset(
+            _SAMPLE_CHARACTERS | _characters_in(parsed, set())
+        )
+        # characters of the sample by their lowercase form, to look up the
+        # ones a literal matches without going through the whole sample
+        by_lower: Dict[str, Set[str]] = {}
+        for c in self._universe:
+            by_lower.setdefault(c.lower(), set()).add(c)
+        self._by_lower = {
+            lower: frozenset(characters) for lower, characters in by_lower.items()
+        }
+        # first characters by subpattern and by character set, as both are
+        # looked up again for every part they are compared with
+        self._sequence_firsts: Dict[int, FrozenSet[str]] = {}
+        self._set_firsts: Dict[Tuple, FrozenSet[str]] = {}
+
+    def _width(self, op, av) -> Tuple[int, int]:
+        return sre_parse.SubPattern(self._state, [(op, av)]).getwidth()
+
+    def _sequence_first(self, subpattern) -> FrozenSet[str]:
+        """Characters a parsed pattern can start with"""
+        first = self._sequence_firsts.get(id(subpattern))
+        if first is None:
+            characters: Set[str] = set()
+            for op, av in subpattern:
+                characters |= self._item_first(op, av)
+                if self._width(op, av)[0] > 0:
+                    break
+            first = self._sequence_firsts[id(subpattern)] = frozenset(characters)
+        return first
+
+    def _item_first(self, op, av) -> FrozenSet[str]:
+        """Characters a single item of a parsed pattern can start with"""
+        if op is sre_parse.LITERAL:
+            return self._by_lower[chr(av).lower()]
+        if op is sre_parse.NOT_LITERAL:
+            return self._universe - self._by_lower[chr(av).lower()]
+        if op is sre_parse.ANY:
+            return self._universe - {"\n"}
+        if op is sre_parse.IN:
+            key = tuple(av)
+            first = self._set_firsts.get(key)
+            if first is None:
+                first = self._set_firsts[key] = frozenset(
+                    c for c in self._universe if _matches_character(op, av, c)
+                )
+            return first
+        if op in _REPEATS:
+            return self._sequence_first(av[2]) if av[1] > 0 else frozenset()
+        if op is sre_parse.SUBPATTERN:
+            return self._sequence_first(av[-1])
+        if op is sre_parse.BRANCH:
+            return frozenset().union(*(self._sequence_first(item) for item in av[1]))
+        if op in _ZERO_WIDTH:
+            return frozenset()
+        return self._universe
+
+    def _is_ambiguous(self, alternatives, follow: FrozenSet[str]) -> bool:
+        """Whether more than one alternative can match at the same position"""
+        seen: FrozenSet[str] = frozenset()
+        for item in alternatives:
+            item_first = self._sequence_first(item)
+            if item.getwidth()[0] == 0:
+                item_first |= follow
+            if item_first & seen:
+                return True
+            seen |= item_first
+        return False
+
+    def is_prone(
+        self,
+        subpattern,
+        follow: FrozenSet[str] = frozenset(),
+        variable_follow: FrozenSet[str] = frozenset(),
+        in_unbounded_repeat: bool = False,
+    ) -> bool:
+        """
+        Arguments:
+            subpattern -- Parsed pattern
+            follow -- Characters that can come after the pattern
+            variable_follow -- Characters that the variable-length items
+                               coming right after the pattern can start with
+            in_unbounded_repeat -- Whether the pattern is repeated without
+                                   bound
+        """
+        # right to left, so that what can follow each item is known when
+        # getting to it
+        for op, av in reversed(list(subpattern)):
+            first = self._item_first(op, av)
+            low_width, high_width = self._width(op, av)
+
+            if low_width != high_width and first & variable_follow:
+                return True
+
+            if op in _REPEATS:
+                low, high, item = av
+                if in_unbounded_repeat and high > 1:
+                    return True
+                if in_unbounded_repeat and low < high and first & follow:
+                    return True
+                item_follow, item_variable_follow = follow, variable_follow
+                if high > 1:
+                    # another repetition can follow each one
+                    item_follow = follow | first
+                    if high != sre_parse.MAXREPEAT:
+                        item_variable_follow = variable_follow | first
+                if self.is_prone(
+                    item,
+                    item_follow,
+                    item_variable_follow,
+                    in_unbounded_repeat or high == sre_parse.MAXREPEAT,
+                ):
+                    return True
+            elif op in _GROUP_REFERENCES:
+                return True
+            elif op is sre_parse.SUBPATTERN:
+                if self.is_prone(av[-1], follow, variable_follow, in_unbounded_repeat):
+                    return True
+            elif op is sre_parse.BRANCH:
+                if in_unbounded_repeat and self._is_ambiguous(av[1], follow):
+                    return True
+                if any(
+                    self.is_prone(item, follow, variable_follow, in_unbounded_repeat)
+                    for item in av[1]
+                ):
+                    return True
+
+            # what can follow the item to the left
+            variable_first = first if low_width != high_width else frozenset()
+            if low_width == 0:
+                follow = first | follow
+                variable_follow = variable_first | variable_follow
+            else:
+                follow = first
+                variable_follow = variable_first
+
+        return False
+
+
+def _class_end(pattern: str, start: int) -> int:
+    # index after the character class opened at start, following Python's
+    # rules: "]" is literal right after "[" or "[^", "[" is never special
+    position = start + 1
+    if pattern.startswith("^", position):
+        position += 1
+    if pattern.startswith("]", position):
+        position += 1
+    while position < len(pattern):
+        if pattern[position] == "\\":
+            position += 2
+        elif pattern[position] == "]":
+            return position + 1
+        else:
+            position += 1
+    return len(pattern)
+
+
+def _decompose_literals(pattern: str) -> str:
+    # The highlighter matches decomposed (NFD) text, so precomposed characters
+    # in the pattern have to be decomposed too, and grouped for quantifiers to
+    # apply to all of their parts. Character classes are left alone, as a
+    # decomposed character cannot be a single item of a class.
+    parts = []
+    position = 0
+    while position < len(pattern):
+        c = pattern[position]
+        if c == "\\" and pattern[position + 1 : position + 2].isascii():
+            end = position + 2
+        elif c == "[":
+            end = _class_end(pattern, position)
+        else:
+            if c == "\\":
+                # escaped non-ASCII characters are literal, but invalid in
+                # JavaScript's unicode mode
+                position += 1
+                c = pattern[position]
+            end = position + 1
+            decomposed = unicodedata.normalize("NFD", c)
+            if len(decomposed) > 1 and pattern[end : end + 1] in _QUANTIFIERS:
+                decomposed = "(?:%s)" % decomposed
+            parts.append(decomposed)
+            position = end
+            continue
+        parts.append(pattern[position:end])
+        position = end
+    return "".join(parts)
+
+
+@lru_cache(maxsize=128)
+def translate_regex(pattern: str) -> Optional[str]:
+    """
+    Translate the value of an re: search into the source of an equivalent
+    JavaScript regular expression
+
+    Arguments:
+        pattern {str} -- Regular expression, with escapes as typed in the
+                         search bar
+
+    Returns:
+        Optional[str] -- Pattern source, or None if the pattern is invalid,
+                         uses syntax that cannot be translated, can match
+                         the empty string, is excessively long, or could
+                         take excessively long to match
+    """
+    pattern = pattern.replace('\\"', '"')
+    if pattern.startswith(_CASE_INSENSITIVE_FLAG):
+        pattern = pattern[len(_CASE_INSENSITIVE_FLAG) :]
+
+    if not pattern or _INLINE_FLAGS.search(pattern):
+        return None
+
+    if len(pattern) > _MAX_PATTERN_LENGTH:
+        return None
+
+    # group names may not repeat across the terms combined by the highlighter
+    pattern = _NAMED_GROUP.sub("(?P<", pattern)
+    try:
+        with warnings.catch_warnings():
+            # e.g. FutureWarning for "[[", which is valid, if ambiguous
+            warnings.simplefilter("ignore")
+            parsed = sre_parse.parse(pattern)
+    except (re.error, RecursionError):
+        return None
+
+    if parsed.getwidth()[0] == 0 or _BacktrackingCheck(parsed).is_prone(parsed):
+        return None
+
+    return _decompose_literals(re.sub(r"\(\?P<[a-zA-Z_]\w*>", "(?:", pattern))
+
+
+@lru_cache(maxsize=128)
+def translate_wildcards(
+    value: str, escape_supported: bool = True, no_combining: bool = False
+) -> Tuple[str, bool]:
+    """
+    Translate a search term using Anki's wildcards ("*" for any number of
+    characters, "_" for a single one) into a pattern for the highlighter
+
+    Arguments:
+        value {str} -- Search term, with escapes (e.g. "\\*" for a literal
+                       asterisk) as typed in the search bar
+        escape_supported {bool} -- Whether the query language supports
+                                   escape characters
+        no_combining {bool} -- Whether to ignore accents and other combining
+                               marks, like nc: searches do
+
+    Returns:
+        Tuple[str, bool] -- Pattern, and whether it is the source of a
+                            regular expression rather than plain text.
+                            The pattern is empty if the term does not
+                            contain any literal text.
+    """
+    if no_combining:
+        value = strip_combining(value)
+
+    # alternating literal text and runs of wildcards, starting with text
+    parts: List[str] = [""]
+    characters = iter(value)
+    for c in characters:
+        if c == "\\" and escape_supported:
+            parts[-1] += next(characters, "")
+        elif c in _WILDCARDS and len(parts) > 1 and not parts[-1]:
+            parts[-2] += c
+        elif c in _WILDCARDS:
+            parts.extend((c, ""))
+        else:
+            parts[-1] += c
+
+    # A run matches one character per "_", then any number more if it contains
+    # a "*". Terms are matched anywhere in the text, so outer "*" are implied.
+    if len(parts) > 1 and not parts[0]:
+        parts[1] = parts[1].lstrip("*")
+    for index in range(1, len(parts), 2):
+        run = "_" * parts[index].count("_")
+        if "*" in parts[index] and parts[index + 1]:
+            run += "*"
+        parts[index] = run
+    if len(parts) > 1 and not parts[0] and not parts[1]:
+        del parts[:2]
+    if len(parts) > 1 and not parts[-1] and not parts[-2]:
+        del parts[-2:]
+
+    if not any(parts[::2]):
+        return "", False
+    if len(parts) == 1 and not no_combining:
+        return parts[0], False
+
+    escape = _escape_ignoring_combining if no_combining else escape_regex
+    literals = [unicodedata.normalize("NFD", part) for part in parts[::2]]
+    runs = parts[1::2]
+
+    def up_to_next_star(index: int) -> Tuple[str, bool]:
+        source = ""
+        for run, literal in zip(runs[index:], literals[index + 1 :]):
+            source += _ANY_CHARACTER * run.count("_")
+            if run.endswith("*"):
+                return source, False
+            source += escape(literal)
+        return source, True
+
+    source = escape(literals[0])
+    for index, run in enumerate(runs):
+        source += _ANY_CHARACTER * run.count("_")
+        literal = literals[index + 1]
+        if run.endswith("*"):
+            following, last = up_to_next_star(index + 1)
+            rest = escape(literal[1:]) + following
+            if no_combining:
+                unless = "(?!%s%s)" % (_COMBINING_MARKS, rest) if rest else ""
+            elif last:
+                # the highlighter does not end matches before combining marks
+                unless = r"(?!%s(?!\p{M}))" % rest if rest else r"(?=\p{M})"
+            else:
+                unless = "(?!%s)" % rest if rest else ""
+            source += _skip_to(literal[0], unless)
+        source += escape(literal)
+    return source, True
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+# Highlight Search Results in the Browser Add-on for Anki
+#
+# Copyright (C) 2017-2020  Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+"""
+Deferred execution of highlighting work
+"""
+
+from typing import Callable
+
+from aqt.qt import QObject, QTimer
+
+
+class HighlightScheduler:
+    """
+    Coalesces bursts of highlight requests into a single deferred call
+
+    Each request restarts a single-shot timer, so that only the last
+    request in a quick succession of them (e.g. while holding down an
+    arrow key in the Browser table) is actually carried out.
+    """
+
+    def __init__(self, parent: QObject, callback: Callable[[], None], delay: int):
+        self._callback = callback
+        self._timer = QTimer(parent)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._callback)  # type: ignore
+        self.delay = delay
+
+    @property
+    def delay(self) -> int:
+        """Delay in milliseconds"""
+        return self._timer.interval()
+
+    @delay.setter
+    def delay(self, delay: int):
+        self._timer.setInterval(max(0, delay))
+
+    def schedule(self):
+        """Request a call, superseding any request that is still pending"""
+        if self.delay == 0:
+            self.cancel()
+            self._callback()
+            return
+        self._timer.start()
+
+    def cancel(self):
+        """Drop any pending request"""
+        self._timer.stop()
+
+    @property
+    def pending(self) -> bool:
+        return self._timer.isActive()
@@ -30,8 +30,24 @@
 #
 # Any modifications to this file must keep this entire header intact.
 
+import re
 from enum import Enum
-from typing import Union, List, Tuple, Dict
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import (
+    AbstractSet,
+    FrozenSet,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Pattern,
+    Tuple,
+    Union,
+)
+
+from .regex_terms import translate_regex, translate_wildcards
 
 
 class QueryLanguageVersion(Enum):
@@ -39,55 +55,284 @@ class QueryLanguageVersion(Enum):
     ANKI2124 = 1
 
 
-class SearchTokenizer:
+class TokenKind(Enum):
+    TERM = 0
+    OPERATOR = 1
+    PAREN = 2
+    NEGATION = 3
 
-    _operators_common: Tuple[str, ...] = ("or", "OR", "and", "AND", "+")
-    _stripped_chars_common: str = '",*;'
-    _ignored_values_common: Tuple[str, ...] = ("*", "_", "_*")
-
-    _ignored_tags_common: Tuple[str, ...] = (
-        # default query language:
-        "added:",
-        "deck:",
-        "note:",
-        "tag:",
-        "mid:",
-        "nid:",
-        "cid:",
-        "card:",
-        "is:",
-        "flag:",
-        "rated:",
-        "dupe:",
-        "prop:",
-        # added by add-ons:
-        "seen:",
-        "rid:",
-    )
 
-    _ignored_tags_by_version: Dict[QueryLanguageVersion, Tuple[str, ...]] = {
-        QueryLanguageVersion.ANKI2100: tuple(),
-        QueryLanguageVersion.ANKI2124: ("re:", "nc:"),
-    }
+class SearchToken(NamedTuple):
+    """
+    Token of a search query, along with everything later stages need to
+    know about it
+
+    start and end delimit the token's raw span in the query, including any
+    quotes and escape characters. Tokens are verbatim if their text is
+    identical to that span (the common case), in which case the text is not
+    stored separately.
+    """
+
+    kind: TokenKind
+    query: str
+    start: int
+    end: int
+    #: offset of the value (i.e. the part after the field prefix) in text,
+    #: or 0 if there is no field prefix
+    value_start: int = 0
+    quoted: bool = False
+    #: text of tokens that are not verbatim
+    unescaped_text: Optional[str] = None
+
+    @property
+    def text(self) -> str:
+        """Token text, as returned by SearchTokenizer.tokenize"""
+        if self.unescaped_text is None:
+            return self.query[self.start : self.end]
+        return self.unescaped_text
+
+    @property
+    def field(self) -> Optional[str]:
+        """Field prefix (e.g. "deck" for "deck:current") of terms, if any"""
+        if not self.value_start:
+            return None
+        if self.unescaped_text is None:
+            return self.query[self.start : self.start + self.value_start - 1]
+        return self.unescaped_text[: self.value_start - 1]
+
+    @property
+    def verbatim(self) -> bool:
+        """Whether the token's text is identical to its span in the query"""
+        return self.unescaped_text is None
+
+    @property
+    def value(self) -> str:
+        if self.unescaped_text is None:
+            return self.query[self.start + self.value_start : self.end]
+        return self.unescaped_text[self.value_start :]
+
+    @property
+    def raw_value(self) -> str:
+        """
+        Value as typed in the query, i.e. with escape characters retained,
+        but without the field prefix and enclosing quotes
+        """
+        if self.unescaped_text is None:
+            return self.value
+        raw = self.query[self.start : self.end]
+        if self.quoted and len(raw) > 1 and raw[0] == raw[-1] and raw[0] in "\"'":
+            # quotes enclosing the whole token, e.g. "front:two words"
+            raw = raw[1:-1]
+        if self.value_start:
+            raw = raw[raw.index(":") + 1 :]
+        if self.quoted and len(raw) > 1 and raw[0] == raw[-1] and raw[0] in "\"'":
+            # quotes enclosing the value, e.g. front:"two words"
+            raw = raw[1:-1]
+        return raw
+
+    def __repr__(self) -> str:
+        return "{}({}, {!r}, {}:{})".format(
+            self.__class__.__name__, self.kind.name, self.text, self.start, self.end
+        )
+
+
+class SearchTermKind(Enum):
+    TEXT = 0
+    #: text is the source of a JavaScript regular expression
+    REGEX = 1
 
-    _quotes_by_version: Dict[QueryLanguageVersion, Tuple[str, ...]] = {
-        QueryLanguageVersion.ANKI2100: ('"',),
-        QueryLanguageVersion.ANKI2124: ('"', "'"),
+
+class SearchTerm(NamedTuple):
+    """Search term to highlight, optionally limited to the field it targets"""
+
+    text: str
+    field: Optional[str] = None
+    kind: SearchTermKind = SearchTermKind.TEXT
+
+
+_SEPARATORS: Tuple[str, ...] = (" ", "\u3000")
+
+_OPERATORS_COMMON: Tuple[str, ...] = ("or", "OR", "and", "AND", "+")
+_STRIPPED_CHARS_COMMON: str = '",*;'
+_IGNORED_VALUES_COMMON: Tuple[str, ...] = ("*", "_", "_*")
+
+_IGNORED_TAGS_COMMON: Tuple[str, ...] = (
+    # default query language:
+    "added:",
+    "deck:",
+    "note:",
+    "tag:",
+    "mid:",
+    "nid:",
+    "cid:",
+    "card:",
+    "is:",
+    "flag:",
+    "rated:",
+    "dupe:",
+    "prop:",
+    # added by add-ons:
+    "seen:",
+    "rid:",
+)
+
+
+def _split_tag(tag: str) -> str:
+    """Return the field name of a search prefix like "deck:" or "deck" """
+    field = tag[:-1] if tag.endswith(":") else tag
+    if not field or ":" in field:
+        raise ValueError("Invalid search prefix: {!r}".format(tag))
+    return field
+
+
+@dataclass(frozen=True)
+class QueryGrammar:
+    """
+    Precomputed tokenizer tables for one query language version
+
+    Ignored tags are indexed by their field name (i.e. the segment before
+    the colon), so that checking a token against them comes down to a
+    single set lookup, however many tags there are.
+    """
+
+    quotes: Tuple[str, ...]
+    escape_supported: bool
+    #: whether "re:" searches for regular expressions
+    regex_supported: bool
+    #: whether "nc:" searches ignoring accents (i.e. combining characters)
+    no_combining_supported: bool
+    #: whether "w:" searches for whole words
+    word_search_supported: bool
+    operators: FrozenSet[str]
+    ignored_fields: FrozenSet[str]
+    ignored_values: Tuple[str, ...]
+    stripped_chars: str
+    #: splits a query into runs of ordinary characters, runs of separators
+    #: and special characters
+    scanner: Pattern
+
+    @classmethod
+    def build(
+        cls,
+        quotes: Tuple[str, ...],
+        escape_supported: bool,
+        regex_supported: bool,
+        no_combining_supported: bool,
+        word_search_supported: bool,
+        ignored_tags: Tuple[str, ...],
+    ) -> "QueryGrammar":
+        special_chars = quotes + _SEPARATORS + ("(", ")", "-")
+        if escape_supported:
+            special_chars += ("\\",)
+
+        special = "".join(re.escape(c) for c in special_chars)
+        separators = "".join(re.escape(c) for c in _SEPARATORS)
+        scanner = re.compile(
+            # runs of ordinary characters that make up a whole token unless
+            # preceded by special characters, along with the separators that
+            # follow them, other runs of ordinary characters, runs of
+            # separators, and single special characters
+            "(?P<word>[^{special}]+)(?:[{separators}]+|(?=\\)|\\Z))"
+            "|(?P<text>[^{special}]+)"
+            "|(?P<separators>[{separators}]+)"
+            "|(?P<special>.)".format(special=special, separators=separators),
+            re.DOTALL,
+        )
+
+        return cls(
+            quotes=quotes,
+            escape_supported=escape_supported,
+            regex_supported=regex_supported,
+            no_combining_supported=no_combining_supported,
+            word_search_supported=word_search_supported,
+            operators=frozenset(_OPERATORS_COMMON),
+            ignored_fields=frozenset(_split_tag(tag) for tag in ignored_tags),
+            ignored_values=_IGNORED_VALUES_COMMON,
+            stripped_chars=_STRIPPED_CHARS_COMMON,
+            scanner=scanner,
+        )
+
+
+#: Tokenizer tables shared by all SearchTokenizer instances
+QUERY_GRAMMARS: Mapping[QueryLanguageVersion, QueryGrammar] = MappingProxyType(
+    {
+        QueryLanguageVersion.ANKI2100: QueryGrammar.build(
+            quotes=('"',),
+            escape_supported=False,
+            regex_supported=False,
+            no_combining_supported=False,
+            word_search_supported=False,
+            ignored_tags=_IGNORED_TAGS_COMMON,
+        ),
+        QueryLanguageVersion.ANKI2124: QueryGrammar.build(
+            quotes=('"', "'"),
+            escape_supported=True,
+            regex_supported=True,
+            no_combining_supported=True,
+            word_search_supported=True,
+            ignored_tags=_IGNORED_TAGS_COMMON,
+        ),
     }
+)
+
 
+class SearchTokenizer:
     def __init__(
         self,
         query_language_version: QueryLanguageVersion = QueryLanguageVersion.ANKI2124,
     ):
+        grammar = QUERY_GRAMMARS[query_language_version]
+
         self._query_language_version = query_language_version
-        self._ignored_values = self._ignored_values_common
-        self._operators = self._operators_common
-        self._stripped_chars = self._stripped_chars_common
-        self._ignored_tags = (
-            self._ignored_tags_common
-            + self._ignored_tags_by_version[query_language_version]
-        )
-        self._quotes = self._quotes_by_version[query_language_version]
+        self._revision = 0
+
+        self._quotes = grammar.quotes
+        self._escape_supported = grammar.escape_supported
+        self._regex_supported = grammar.regex_supported
+        self._no_combining_supported = grammar.no_combining_supported
+        self._word_search_supported = grammar.word_search_supported
+        self._ignored_values = grammar.ignored_values
+        self._stripped_chars = grammar.stripped_chars
+        self._scanner = grammar.scanner
+        # shared with all other tokenizers until rules are registered at runtime
+        self._operators: AbstractSet[str] = grammar.operators
+        self._ignored_fields: AbstractSet[str] = grammar.ignored_fields
+
+    @property
+    def query_language_version(self) -> QueryLanguageVersion:
+        return self._query_language_version
+
+    @property
+    def revision(self) -> int:
+        """Counter that is incremented whenever the tokenizer's rules change"""
+        return self._revision
+
+    def register_ignored_tag(self, tag: str):
+        """
+        Exclude search terms with the given prefix from highlighting
+
+        Arguments:
+            tag {str} -- Search prefix, e.g. "deck:" or "myfield:". The
+                         trailing colon is optional.
+
+        Raises:
+            ValueError -- If the prefix is empty or contains a colon
+                          anywhere but at its end
+        """
+        field = _split_tag(tag)
+        if field in self._ignored_fields:
+            return
+        self._ignored_fields = self._ignored_fields | {field}
+        self._revision += 1
+
+    def register_operator(self, operator: str):
+        """Exclude the given search operator from highlighting"""
+        if not operator:
+            raise ValueError("Invalid search operator: {!r}".format(operator))
+        if operator in self._operators:
+            return
+        self._operators = self._operators | {operator}
+        self._revision += 1
 
     def tokenize(self, query: str) -> List[str]:
         """
@@ -97,9 +342,7 @@ class SearchTokenizer:
         (anki.find.Finder._tokenize)
         """
 
-        _escape_supported = (
-            self._query_language_version.value >= QueryLanguageVersion.ANKI2124.value
-        )
+        _escape_supported = self._escape_supported
 
         in_quote: Union[bool, str] = False
         in_escape: bool = False
@@ -163,19 +406,202 @@ class SearchTokenizer:
 
         return tokens
 
+    def scan(self, query: str) -> List[SearchToken]:
+        """
+        Tokenize search string into SearchToken records
+
+        Token texts are identical to the output of tokenize. Kind, value
+        offset and quoting of each token are determined during the same pass.
+        Tokens made up of ordinary characters only (the vast majority) are
+        matched by the scanner as a whole, and recorded by their span in the
+        query without copying their text.
+        """
+
+        quotes = self._quotes
+        operators = self._operators
+        term_kind = TokenKind.TERM
+        operator_kind = TokenKind.OPERATOR
+
+        in_quote: Union[bool, str] = False
+        in_escape: bool = False
+        tokens: List[SearchToken] = []
+        append = tokens.append
+        parts: List[str] = []
+        # state of the token currently being built
+        token_start = -1
+        verbatim = True
+        quoted = False
+
+        for match in self._scanner.finditer(query):
+            group = match.lastgroup
+            position = match.start()
+
+            if group == "word":
+                in_escape = False
+                word_end = match.end("word")
+                c = query[position:word_end]
+                # whole token of normal characters (never in quotes, as
+                # quotes start a token)
+                if token_start == -1:
+                    if c in operators:
+                        append(SearchToken(operator_kind, query, position, word_end))
+                    else:
+                        append(
+                            SearchToken(
+                                term_kind, query, position, word_end, c.find(":") + 1
+                            )
+                        )
+                    continue
+                # end of a token started by special characters
+                parts.append(c)
+                if word_end == match.end():
+                    continue
+                group = "separators"
+                c = query[word_end : match.end()]
+                position = word_end
+            else:
+                c = match.group()
+
+            # run of normal characters
+            if group == "text":
+                in_escape = False
+                if token_start == -1:
+                    token_start = position
+                parts.append(c)
+            # run of separators (space and ideographic space)
+            elif group == "separators":
+                if in_quote:
+                    parts.append(c)
+                else:
+                    if parts:
+                        # space marks token finished
+                        append(
+                            self._finish_token(
+                                query, parts, token_start, position, verbatim, quoted
+                            )
+                        )
+                        parts = []
+                    token_start = -1
+                    verbatim = True
+                    quoted = False
+            # quoted text
+            elif c in quotes:
+                if token_start == -1:
+                    token_start = position
+                if in_quote:
+                    if c == in_quote and not in_escape:
+                        in_quote = False
+                        verbatim = False
+                    else:
+                        parts.append(c)
+                elif parts:
+                    # quotes are allowed to start directly after a :
+                    if parts[-1][-1] == ":":
+                        in_quote = c
+                        verbatim = False
+                        quoted = True
+                    else:
+                        parts.append(c)
+                else:
+                    in_quote = c
+                    verbatim = False
+                    quoted = True
+            # escaped characters (only matched if escapes are supported)
+            elif c == "\\":
+                if token_start == -1:
+                    token_start = position
+                if in_escape:
+                    # escaped "\"
+                    parts.append(c)
+                    in_escape = False
+                else:
+                    in_escape = True
+                    verbatim = False
+            # nesting
+            elif c == "(" or c == ")":
+                if in_quote:
+                    parts.append(c)
+                    continue
+                if c == ")" and parts:
+                    append(
+                        self._finish_token(
+                            query, parts, token_start, position, verbatim, quoted
+                        )
+                    )
+                    parts = []
+                    token_start = -1
+                    verbatim = True
+                    quoted = False
+                elif token_start != -1:
+                    # symbol is emitted in the middle of a token's span
+                    verbatim = False
+                append(SearchToken(TokenKind.PAREN, query, position, position + 1))
+            # negation
+            elif c == "-":
+                if parts:
+                    parts.append(c)
+                elif not tokens or tokens[-1].kind != TokenKind.NEGATION:
+                    if token_start != -1:
+                        verbatim = False
+                    append(
+                        SearchToken(TokenKind.NEGATION, query, position, position + 1)
+                    )
+        # if we finished in a token, add it
+        if parts:
+            append(
+                self._finish_token(
+                    query, parts, token_start, len(query), verbatim, quoted
+                )
+            )
+
+        return tokens
+
+    def _finish_token(
+        self,
+        query: str,
+        parts: List[str],
+        start: int,
+        end: int,
+        verbatim: bool,
+        quoted: bool,
+    ) -> SearchToken:
+        if verbatim:
+            text = query[start:end]
+            unescaped_text = None
+        else:
+            text = unescaped_text = "".join(parts)
+        if not quoted and text in self._operators:
+            return SearchToken(
+                TokenKind.OPERATOR, query, start, end, 0, False, unescaped_text
+            )
+        return SearchToken(
+            TokenKind.TERM,
+            query,
+            start,
+            end,
+            text.find(":") + 1,
+            quoted,
+            unescaped_text,
+        )
+
     def get_searchable_tokens(self, tokens: List[str]) -> List[str]:
         searchable_tokens: List[str] = []
 
         for token in tokens:
-            if (
-                token in self._operators
-                or token.startswith("-")
-                or token.startswith(self._ignored_tags)
-            ):
+            if token in self._operators or token.startswith("-"):
                 continue
 
-            if ":" in token:
-                value = token.split(":", 1)[1]
+            field, colon, value = token.partition(":")
+
+            if colon:
+                if field in self._ignored_fields:
+                    continue
+                if self._regex_supported and (
+                    field == "re" or value.startswith("re:")
+                ):
+                    continue
+                if self._no_combining_supported and field == "nc":
+                    continue
                 if not value or value in self._ignored_values:
                     continue
             else:
@@ -186,3 +612,148 @@ class SearchTokenizer:
             searchable_tokens.append(value)
 
         return searchable_tokens
+
+    def get_searchable_terms(self, tokens: List[SearchToken]) -> List[SearchTerm]:
+        """
+        Equivalent of get_searchable_tokens for the output of scan, retaining
+        the field each value is searched in (e.g. "front" for "front:dog")
+
+        Unlike get_searchable_tokens, parentheses and empty values are never
+        returned, and quoted operators (e.g. "or") are treated as regular
+        search terms.
+
+        Regular expression searches (e.g. "re:\\d+" or "front:re:\\d+") are
+        returned as REGEX terms, unless they cannot be highlighted safely.
+        So are terms using wildcards (e.g. "th*ory"), and searches ignoring
+        accents (e.g. "nc:uber"), translated to their regular expression
+        equivalent. Whole word searches (e.g. "w:dog") are not limited to a
+        field.
+        """
+        searchable_terms: List[SearchTerm] = []
+        # hoisted out of the loop, which runs once per token
+        append = searchable_terms.append
+        term_kind = TokenKind.TERM
+        ignored_fields = self._ignored_fields
+        ignored_values = self._ignored_values
+        stripped_chars = self._stripped_chars
+        regex_supported = self._regex_supported
+        no_combining_supported = self._no_combining_supported
+        word_search_supported = self._word_search_supported
+
+        for token in tokens:
+            kind, text, start, end, value_start, _, unescaped_text = token
+            if kind is not term_kind:
+                continue
+
+            # same as token.field and token.value, sliced straight from the
+            # query (text, for now) for verbatim tokens
+            if unescaped_text is not None:
+                text = unescaped_text
+                start, end = 0, len(text)
+            if not value_start:
+                field = None
+                value = text[start:end]
+            else:
+                value_start += start
+                field = text[start : value_start - 1]
+                if field in ignored_fields:
+                    continue
+                value = text[value_start:end]
+
+                # "re:..." or "field:re:..."
+                if regex_supported and (field == "re" or value.startswith("re:")):
+                    regex_term = _get_regex_term(token)
+                    if regex_term is not None:
+                        append(regex_term)
+                    continue
+
+                if no_combining_supported and field == "nc":
+                    term = self._get_wildcard_term(token, None, no_combining=True)
+                    if term is not None:
+                        append(term)
+                    continue
+
+                if word_search_supported and field == "w":
+                    # searches for whole words in all fields, rather than
+                    # searching a "w" field
+                    field = None
+
+                if not value or value in ignored_values:
+                    continue
+
+            if "*" in value or "_" in value:
+                term = self._get_wildcard_term(token, field)
+                if term is not None:
+                    append(term)
+                continue
+
+            value = value.strip(stripped_chars)
+
+            if value:
+                append(SearchTerm(value, field))
+
+        return searchable_terms
+
+    def _get_wildcard_term(
+        self, token: SearchToken, field: Optional[str], no_combining: bool = False
+    ) -> Optional[SearchTerm]:
+        if self._escape_supported:
+            # tells escaped wildcards apart from actual ones
+            value = token.raw_value
+        else:
+            value = token.value
+
+        pattern, is_regex = translate_wildcards(
+            value.strip(self._stripped_chars.replace("*", "")),
+            self._escape_supported,
+            no_combining,
+        )
+        if not pattern:
+            return None
+
+        kind = SearchTermKind.REGEX if is_regex else SearchTermKind.TEXT
+        return SearchTerm(pattern, field, kind)
+
+
+def _get_regex_term(token: SearchToken) -> Optional[SearchTerm]:
+    """
+    Return the term for a regular expression search, or None if it cannot
+    be highlighted safely
+    """
+    if token.field == "re":
+        field = None
+        pattern = token.raw_value
+    else:
+        field = token.field
+        pattern = token.raw_value[len("re:") :]
+
+    source = translate_regex(pattern)
+    if source is None:
+        return None
+    return SearchTerm(source, field, SearchTermKind.REGEX)
+
+
+def get_field_ordinals(field: str, field_names: Sequence[str]) -> List[int]:
+    """
+    Return the ordinals of all fields matched by a field search prefix
+
+    Like Anki, field names are compared case-insensitively, and "*" in the
+    prefix matches any sequence of characters.
+    """
+    if "*" not in field:
+        folded_field = field.casefold()
+        return [
+            ordinal
+            for ordinal, name in enumerate(field_names)
+            if name.casefold() == folded_field
+        ]
+
+    pattern = re.compile(
+        ".*".join(re.escape(part) for part in field.split("*")),
+        re.IGNORECASE | re.DOTALL,
+    )
+    return [
+        ordinal
+        for ordinal, name in enumerate(field_names)
+        if pattern.fullmatch(name)
+    ]
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+# Highlight Search Results in the Browser Add-on for Anki
+#
+# Copyright (C) 2017-2020  Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+"""
+Search terms of the current Browser search, shared with all the views
+that highlight them
+"""
+
+from typing import Callable, List, Tuple
+
+from .query import SearchTermsCache
+from .search import QueryLanguageVersion, SearchTerm, SearchTokenizer
+
+TermsCallback = Callable[[Tuple[SearchTerm, ...]], None]
+
+
+class HighlightService:
+    """
+    Turns Browser searches into the terms to highlight, and pushes them to
+    every view subscribed to them (e.g. the editor, the Browser table, and
+    the card previewer)
+
+    Each search is tokenized and parsed once, no matter how many views are
+    attached. Other add-ons can subscribe in order to highlight their own
+    web views, or register search prefixes of their own to keep out of
+    highlighting.
+    """
+
+    def __init__(
+        self,
+        query_language_version: QueryLanguageVersion = QueryLanguageVersion.ANKI2124,
+    ):
+        self._query_language_version = query_language_version
+        # search prefixes registered at runtime, on top of the tokenizer's
+        # defaults
+        self._extra_ignored_tags: List[str] = []
+        self._terms_cache = SearchTermsCache(self._create_tokenizer())
+        self._terms: Tuple[SearchTerm, ...] = ()
+        self._subscribers: List[TermsCallback] = []
+
+    def _create_tokenizer(self) -> SearchTokenizer:
+        tokenizer = SearchTokenizer(self._query_language_version)
+        for tag in self._extra_ignored_tags:
+            tokenizer.register_ignored_tag(tag)
+        return tokenizer
+
+    @property
+    def query_language_version(self) -> QueryLanguageVersion:
+        return self._query_language_version
+
+    @query_language_version.setter
+    def query_language_version(self, query_language_version: QueryLanguageVersion):
+        """Swap out the search tokenizer, invalidating all cached search terms"""
+        self._query_language_version = query_language_version
+        self._terms_cache.tokenizer = self._create_tokenizer()
+
+    @property
+    def terms_cache(self) -> SearchTermsCache:
+        return self._terms_cache
+
+    def register_ignored_search_prefix(self, prefix: str):
+        """
+        Exclude search terms with the given prefix (e.g. "myaddon:") from
+        highlighting
+
+        Arguments:
+            prefix {str} -- Search prefix, with or without trailing colon
+
+        Raises:
+            ValueError -- If the prefix is invalid
+        """
+        self._terms_cache.tokenizer.register_ignored_tag(prefix)
+        if prefix not in self._extra_ignored_tags:
+            self._extra_ignored_tags.append(prefix)
+
+    def get_terms(self, search_text: str) -> Tuple[SearchTerm, ...]:
+        """Return the terms to highlight for search_text, without publishing them"""
+        if not search_text:
+            return ()
+        return self._terms_cache.get_terms(search_text)
+
+    @property
+    def terms(self) -> Tuple[SearchTerm, ...]:
+        """Terms of the current search"""
+        return self._terms
+
+    def set_search(self, search_text: str):
+        """
+        Make search_text the current search, notifying subscribers if the
+        terms to highlight changed
+        """
+        self._set_terms(self.get_terms(search_text))
+
+    def clear(self):
+        self._set_terms(())
+
+    def _set_terms(self, terms: Tuple[SearchTerm, ...]):
+        if terms == self._terms:
+            return
+        self._terms = terms
+        # subscribers might unsubscribe while being notified
+        for callback in list(self._subscribers):
+            callback(terms)
+
+    def subscribe(self, callback: TermsCallback):
+        """Call callback with the new terms whenever the current search changes"""
+        if callback not in self._subscribers:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: TermsCallback):
+        try:
+            self._subscribers.remove(callback)
+        except ValueError:
+            pass
+
+
+#: Service shared by the add-on's components, and available to other add-ons
+highlight_service = HighlightService()
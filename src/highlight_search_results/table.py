@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+# Highlight Search Results in the Browser Add-on for Anki
+#
+# Copyright (C) 2017-2020  Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+"""
+Highlighting of search results in the cells of the Browser table
+"""
+
+from typing import Callable, Optional, Tuple
+
+from aqt.qt import (
+    QAbstractItemDelegate,
+    QApplication,
+    QColor,
+    QFontMetrics,
+    QModelIndex,
+    QPainter,
+    QRectF,
+    QStyle,
+    QStyledItemDelegate,
+    QStyleOptionViewItem,
+    Qt,
+    QWidget,
+)
+
+from .matches import MatchSpanCache, Span, compile_terms
+from .search import SearchTerm
+
+#: columns whose cells are highlighted, i.e. the sort field and question
+HIGHLIGHTED_COLUMNS = frozenset(("noteFld", "question"))
+
+# translucent, so that the text painted underneath remains legible
+_HIGHLIGHT_COLOR = QColor(255, 255, 0, 110)
+
+
+class TableHighlightDelegate(QStyledItemDelegate):
+    """
+    Item delegate painting search term matches over the Browser table's
+    cells
+
+    Painting is left to the delegate the table was set up with (e.g. the one
+    Anki uses to color rows), with highlights drawn on top. As only visible
+    cells get painted, match spans are computed lazily for the rows in view,
+    and then kept in an LRU cache so that scrolling back and forth does not
+    search the same cells again.
+    """
+
+    def __init__(
+        self,
+        parent: QWidget,
+        base_delegate: Optional[QAbstractItemDelegate],
+        get_terms: Callable[[], Tuple[SearchTerm, ...]],
+        get_item_id: Callable[[int], Optional[int]],
+        get_column_key: Callable[[int], Optional[str]],
+    ):
+        super().__init__(parent)
+        self._base_delegate = base_delegate
+        self._get_terms = get_terms
+        self._get_item_id = get_item_id
+        self._get_column_key = get_column_key
+        self.span_cache = MatchSpanCache()
+
+    def sizeHint(self, option: QStyleOptionViewItem, index: QModelIndex):
+        if self._base_delegate is not None:
+            return self._base_delegate.sizeHint(option, index)
+        return super().sizeHint(option, index)
+
+    def paint(
+        self, painter: QPainter, option: QStyleOptionViewItem, index: QModelIndex
+    ):
+        if self._base_delegate is not None:
+            self._base_delegate.paint(painter, option, index)
+        else:
+            super().paint(painter, option, index)
+
+        if option.direction == Qt.RightToLeft:
+            # set by the base delegate for right-to-left text, not supported
+            return
+
+        text = index.data(Qt.DisplayRole)
+        if not text:
+            return
+
+        spans = self._get_spans(index, text)
+        if spans:
+            self._paint_spans(painter, option, index, text, spans)
+
+    def _get_spans(self, index: QModelIndex, text: str) -> Tuple[Span, ...]:
+        column_key = self._get_column_key(index.column())
+        if column_key not in HIGHLIGHTED_COLUMNS:
+            return ()
+
+        terms = self._get_terms()
+        if not terms:
+            return ()
+        pattern = compile_terms(terms)
+        if pattern is None:
+            return ()
+
+        item_id = self._get_item_id(index.row())
+        if item_id is None:
+            return ()
+
+        return self.span_cache.get_spans((item_id, column_key, terms), text, pattern)
+
+    def _paint_spans(
+        self,
+        painter: QPainter,
+        option: QStyleOptionViewItem,
+        index: QModelIndex,
+        text: str,
+        spans: Tuple[Span, ...],
+    ):
+        widget = option.widget
+        style = widget.style() if widget else QApplication.style()
+        # same text margins as Qt's item delegates
+        margin = style.pixelMetric(QStyle.PM_FocusFrameHMargin, None, widget) + 1
+        rect = QRectF(option.rect.adjusted(margin, 0, -margin, 0))
+
+        metrics = QFontMetrics(option.font)
+        elided_text = metrics.elidedText(text, Qt.ElideRight, int(rect.width()))
+        # characters actually displayed, not counting the ellipsis
+        visible_length = len(text) if elided_text == text else len(elided_text) - 1
+
+        alignment = index.data(Qt.TextAlignmentRole)
+        text_width = metrics.horizontalAdvance(elided_text)
+        left = rect.left()
+        if alignment is not None and int(alignment) & Qt.AlignHCenter:
+            left += (rect.width() - text_width) / 2
+        elif alignment is not None and int(alignment) & Qt.AlignRight:
+            left += rect.width() - text_width
+        top = rect.top() + (rect.height() - metrics.height()) / 2
+
+        painter.save()
+        painter.setClipRect(option.rect)
+        for start, end in spans:
+            if start >= visible_length:
+                break
+            end = min(end, visible_length)
+            painter.fillRect(
+                QRectF(
+                    left + metrics.horizontalAdvance(text[:start]),
+                    top,
+                    metrics.horizontalAdvance(text[start:end]),
+                    metrics.height(),
+                ),
+                _HIGHLIGHT_COLOR,
+            )
+        painter.restore()
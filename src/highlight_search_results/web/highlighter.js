@@ -0,0 +1,643 @@
+/*
+ * Highlight Search Results in the Browser Add-on for Anki
+ *
+ * Copyright (C) 2017-2020  Aristotelis P. <https://glutanimate.com/>
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU Affero General Public License as
+ * published by the Free Software Foundation, either version 3 of the
+ * License, or (at your option) any later version, with the additions
+ * listed at the end of the license file that accompanied this program.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU Affero General Public License for more details.
+ *
+ * You should have received a copy of the GNU Affero General Public License
+ * along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ *
+ * NOTE: This program is subject to certain additional terms pursuant to
+ * Section 7 of the GNU Affero General Public License.  You should have
+ * received a copy of these additional terms immediately following the
+ * terms and conditions of the GNU Affero General Public License that
+ * accompanied this program.
+ *
+ * If not, please request a copy through one of the means of contact
+ * listed here: <https://glutanimate.com/contact/>.
+ *
+ * Any modifications to this file must keep this entire header intact.
+ */
+
+/*
+ * Highlights search terms by wrapping their matches in marker spans.
+ *
+ * Only the contents of the editor's fields are searched, leaving labels
+ * and other UI text alone. Each field's text nodes are matched in a single
+ * TreeWalker pass, using one combined pattern of all the terms that apply
+ * to that field. Text is matched in decomposed form (NFD), so that accented
+ * characters match regardless of how they are encoded in the note, with
+ * an offset map leading back to the original text. Matching is capped at a
+ * time budget per field, so that a pathological regular expression cannot
+ * hang the page. Work is split into time-sliced chunks, starting with the
+ * fields in view, so that large fields do not block the page. Edits to
+ * highlighted fields are observed, and only the text nodes they touch are
+ * highlighted again. Pages rendered by Anki itself (e.g. the card previewer)
+ * are searched as a whole instead, skipping typeset math.
+ *
+ * The script is installed once per page load and exposes a versioned
+ * entry point on window.HighlightSearchResults:
+ *
+ *   highlight(terms, options)  -- replace current highlights
+ *   clear()                    -- remove all highlights
+ */
+
+(function () {
+    "use strict";
+
+    // needs to be kept in sync with HIGHLIGHTER_VERSION in webview.py
+    const VERSION = 5;
+
+    const installed = window.HighlightSearchResults;
+    if (installed && installed.version === VERSION) {
+        return;
+    }
+    if (installed) {
+        // different version left over from before an add-on update
+        installed.clear();
+    }
+
+    const MARK_CLASS = "hsr-highlight";
+    const MARK_STYLE = "background-color: #ffff00; color: #000000;";
+    const SKIPPED_TAGS = new Set(["SCRIPT", "STYLE", "NOSCRIPT", "TEXTAREA"]);
+    // elements rendered by MathJax, which breaks if their text is split up
+    const MATHJAX_TAG_PREFIX = "MJX-";
+
+    // time budget per chunk of work when idle callbacks are unavailable
+    const CHUNK_BUDGET_MS = 8;
+    // total matching time after which highlighting a field is abandoned
+    const FIELD_BUDGET_MS = 250;
+    const MAX_CACHED_PATTERNS = 32;
+    const NO_TRAILING_MARKS = "(?!\\p{M})";
+
+    let marks = [];
+    let pendingHighlight = null;
+    // incremented to cancel the highlighting pass in progress, if any
+    let currentPass = 0;
+    // patterns of the roots highlighted by the current pass
+    let rootPatterns = new Map();
+    let observer = null;
+    // combined patterns, kept across passes for repeated searches
+    let patternCache = new Map();
+
+    function escapeRegExp(text) {
+        return text.replace(/[.*+?^${}()|[\]\\]/g, "\\$&");
+    }
+
+    function isValidRegExp(source) {
+        try {
+            new RegExp(source, "giu");
+            return true;
+        } catch (error) {
+            return false;
+        }
+    }
+
+    /*
+     * terms: [{text: string, regex: boolean}]
+     */
+    function buildPattern(terms) {
+        // text is matched in decomposed form. Regular expressions come
+        // decomposed already, as normalizing their syntax could break it.
+        const sources = terms
+            .filter((term) => !term.regex && term.text.length > 0)
+            .map((term) => term.text.normalize("NFD"))
+            // prefer longer matches for terms sharing a prefix
+            .sort((a, b) => b.length - a.length)
+            .map(escapeRegExp)
+            .concat(terms.filter((term) => term.regex).map((term) => term.text))
+            // never end a match in the middle of an accented character
+            .map((source) => "(?:" + source + ")" + NO_TRAILING_MARKS)
+            // syntax accepted by Anki is not necessarily valid here
+            .filter(isValidRegExp);
+        if (!sources.length) {
+            return null;
+        }
+        return new RegExp(sources.join("|"), "giu");
+    }
+
+    function getPattern(terms) {
+        const key = terms
+            .map((term) => (term.regex ? "r" : "t") + term.text)
+            .join("\u0000");
+        if (patternCache.has(key)) {
+            return patternCache.get(key);
+        }
+        if (patternCache.size >= MAX_CACHED_PATTERNS) {
+            patternCache = new Map();
+        }
+        const pattern = buildPattern(terms);
+        patternCache.set(key, pattern);
+        return pattern;
+    }
+
+    function skipSubtree(walker) {
+        for (;;) {
+            const sibling = walker.nextSibling();
+            if (sibling) {
+                return sibling;
+            }
+            if (!walker.parentNode()) {
+                return null;
+            }
+        }
+    }
+
+    /*
+     * Yields the text nodes below root in document order. The walker is
+     * advanced before each node is handed out, so consumers are free to
+     * replace the node they were given.
+     */
+    function* textNodes(root) {
+        const walker = document.createTreeWalker(
+            root,
+            NodeFilter.SHOW_ELEMENT | NodeFilter.SHOW_TEXT
+        );
+        let node = walker.nextNode();
+        while (node) {
+            const current = node;
+            if (current.nodeType === Node.TEXT_NODE) {
+                node = walker.nextNode();
+                if (current.nodeValue.trim()) {
+                    yield current;
+                }
+            } else if (
+                SKIPPED_TAGS.has(current.tagName) ||
+                current.tagName.startsWith(MATHJAX_TAG_PREFIX)
+            ) {
+                node = skipSubtree(walker);
+            } else {
+                if (current.shadowRoot) {
+                    yield* textNodes(current.shadowRoot);
+                }
+                node = walker.nextNode();
+            }
+        }
+    }
+
+    function findFieldRoots() {
+        const editables = [];
+        const visit = (root) => {
+            for (const element of root.querySelectorAll("*")) {
+                if (element.tagName === "ANKI-EDITABLE") {
+                    editables.push(element);
+                }
+                if (element.shadowRoot) {
+                    visit(element.shadowRoot);
+                }
+            }
+        };
+        visit(document);
+        if (editables.length) {
+            return editables;
+        }
+
+        // legacy editor: fields are content-editable elements with ids f0, f1, ...
+        const fieldRoots = [];
+        for (const element of document.querySelectorAll("[contenteditable]")) {
+            const match = /^f(\d+)$/.exec(element.id);
+            if (match) {
+                fieldRoots[parseInt(match[1], 10)] = element;
+            }
+        }
+        return fieldRoots;
+    }
+
+    function createMark(text) {
+        const mark = document.createElement("span");
+        mark.className = MARK_CLASS;
+        mark.setAttribute("style", MARK_STYLE);
+        mark.textContent = text;
+        marks.push(mark);
+        return mark;
+    }
+
+    /*
+     * Returns text in decomposed form (NFD), along with the offsets of the
+     * characters in text that each of its code units originates from, or
+     * null offsets if text was decomposed already
+     */
+    function foldText(text) {
+        if (text.normalize("NFD") === text) {
+            return { text: text, starts: null, ends: null };
+        }
+        const parts = [];
+        const starts = [];
+        const ends = [];
+        let offset = 0;
+        // decomposing character by character keeps the offsets aligned
+        for (const character of text) {
+            const decomposed = character.normalize("NFD");
+            const end = offset + character.length;
+            for (let i = 0; i < decomposed.length; i++) {
+                starts.push(offset);
+                ends.push(end);
+            }
+            parts.push(decomposed);
+            offset = end;
+        }
+        return { text: parts.join(""), starts: starts, ends: ends };
+    }
+
+    /*
+     * Returns the nodes that replaced textNode, or null if nothing matched.
+     * Matching stops early once deadline (a performance.now() timestamp)
+     * has passed.
+     */
+    function wrapMatches(textNode, pattern, deadline) {
+        if (!textNode.parentNode) {
+            // replaced by the editor since the pass started
+            return null;
+        }
+        const text = textNode.nodeValue;
+        const folded = foldText(text);
+        const pieces = [];
+        let lastIndex = 0;
+        let match;
+
+        pattern.lastIndex = 0;
+        while ((match = pattern.exec(folded.text)) !== null) {
+            if (!match[0].length) {
+                // regular expressions may match the empty string
+                pattern.lastIndex++;
+                continue;
+            }
+            const foldedEnd = match.index + match[0].length;
+            const start = folded.starts ? folded.starts[match.index] : match.index;
+            const end = folded.ends ? folded.ends[foldedEnd - 1] : foldedEnd;
+            if (start < lastIndex) {
+                // starts within a character that is highlighted already
+                continue;
+            }
+            if (start > lastIndex) {
+                pieces.push(document.createTextNode(text.slice(lastIndex, start)));
+            }
+            pieces.push(createMark(text.slice(start, end)));
+            lastIndex = end;
+            if (performance.now() > deadline) {
+                break;
+            }
+        }
+
+        if (!pieces.length) {
+            return null;
+        }
+        if (lastIndex < text.length) {
+            pieces.push(document.createTextNode(text.slice(lastIndex)));
+        }
+
+        const fragment = document.createDocumentFragment();
+        for (const piece of pieces) {
+            fragment.appendChild(piece);
+        }
+        textNode.parentNode.replaceChild(fragment, textNode);
+        return pieces;
+    }
+
+    function isMark(node) {
+        return (
+            node.nodeType === Node.ELEMENT_NODE && node.className === MARK_CLASS
+        );
+    }
+
+    /*
+     * Replace mark with its contents, which can include markup added while
+     * it was in place (e.g. by coloring a letter of a highlighted word)
+     */
+    function unwrapMark(mark) {
+        const parent = mark.parentNode;
+        while (mark.firstChild) {
+            parent.insertBefore(mark.firstChild, mark);
+        }
+        parent.removeChild(mark);
+    }
+
+    function dropMark(mark) {
+        marks = marks.filter((other) => other !== mark);
+        unwrapMark(mark);
+    }
+
+    function findEnclosingMark(node, root) {
+        while (node && node !== root) {
+            if (isMark(node)) {
+                return node;
+            }
+            node = node.parentNode;
+        }
+        return null;
+    }
+
+    function getSelectionFor(node) {
+        const root = node.getRootNode();
+        // selections inside shadow roots are only exposed on the root itself
+        return root.getSelection ? root.getSelection() : document.getSelection();
+    }
+
+    function adjacentTextNodes(node) {
+        const run = [node];
+        let sibling = node.previousSibling;
+        while (sibling && sibling.nodeType === Node.TEXT_NODE) {
+            run.unshift(sibling);
+            sibling = sibling.previousSibling;
+        }
+        sibling = node.nextSibling;
+        while (sibling && sibling.nodeType === Node.TEXT_NODE) {
+            run.push(sibling);
+            sibling = sibling.nextSibling;
+        }
+        return run;
+    }
+
+    /*
+     * Highlight a single text node again after it was edited, merging it with
+     * adjacent text (e.g. left over from an earlier match) and keeping the
+     * caret in place
+     */
+    function rehighlightTextNode(textNode, pattern) {
+        const node = textNode;
+        if (isMark(node.parentNode)) {
+            dropMark(node.parentNode);
+        }
+
+        const run = adjacentTextNodes(node);
+
+        const selection = getSelectionFor(node);
+        let caret = null;
+        if (
+            selection &&
+            selection.isCollapsed &&
+            run.includes(selection.anchorNode)
+        ) {
+            caret = selection.anchorOffset;
+            for (const piece of run) {
+                if (piece === selection.anchorNode) {
+                    break;
+                }
+                caret += piece.data.length;
+            }
+        }
+
+        const parent = node.parentNode;
+        const merged = document.createTextNode(
+            run.map((piece) => piece.data).join("")
+        );
+        parent.replaceChild(merged, run[0]);
+        for (const piece of run.slice(1)) {
+            parent.removeChild(piece);
+        }
+
+        const pieces =
+            wrapMatches(merged, pattern, performance.now() + FIELD_BUDGET_MS) ||
+            [merged];
+
+        if (caret === null) {
+            return;
+        }
+        for (const piece of pieces) {
+            const length = piece.textContent.length;
+            if (caret <= length) {
+                selection.collapse(isMark(piece) ? piece.firstChild : piece, caret);
+                return;
+            }
+            caret -= length;
+        }
+    }
+
+    function findOwningRoot(node) {
+        while (node && !rootPatterns.has(node)) {
+            node = node.parentNode || node.host;
+        }
+        return node;
+    }
+
+    function onMutations(records) {
+        const dirty = new Map();
+
+        for (const record of records) {
+            const root = findOwningRoot(record.target);
+            if (!root) {
+                continue;
+            }
+            if (record.type === "characterData") {
+                dirty.set(record.target, root);
+                continue;
+            }
+            for (const added of record.addedNodes) {
+                if (added.nodeType === Node.TEXT_NODE) {
+                    dirty.set(added, root);
+                } else if (
+                    added.nodeType === Node.ELEMENT_NODE &&
+                    !isMark(added)
+                ) {
+                    // marks only ever wrap plain text, so that they can be
+                    // stripped from the field without touching its markup
+                    const mark = findEnclosingMark(record.target, root);
+                    if (mark && mark.parentNode) {
+                        dropMark(mark);
+                    }
+                    for (const textNode of textNodes(added)) {
+                        dirty.set(textNode, root);
+                    }
+                }
+            }
+        }
+
+        for (const [textNode, root] of dirty) {
+            if (textNode.isConnected && textNode.nodeValue.trim()) {
+                rehighlightTextNode(textNode, rootPatterns.get(root));
+            }
+        }
+
+        // drop the records caused by re-highlighting
+        ignoreOwnMutations();
+    }
+
+    function observe(root) {
+        if (!observer) {
+            observer = new MutationObserver(onMutations);
+        }
+        observer.observe(root, {
+            childList: true,
+            characterData: true,
+            subtree: true,
+        });
+    }
+
+    function ignoreOwnMutations() {
+        if (observer) {
+            observer.takeRecords();
+        }
+    }
+
+    function clear() {
+        currentPass++;
+        if (observer) {
+            observer.disconnect();
+            observer = null;
+        }
+        rootPatterns = new Map();
+        const parents = new Set();
+        for (const mark of marks) {
+            const parent = mark.parentNode;
+            if (!parent) {
+                // discarded along with the rest of its field
+                continue;
+            }
+            unwrapMark(mark);
+            parents.add(parent);
+        }
+        for (const parent of parents) {
+            parent.normalize();
+        }
+        marks = [];
+    }
+
+    function findRoots(scope) {
+        if (scope === "document") {
+            return document.body ? [document.body] : [];
+        }
+        return findFieldRoots();
+    }
+
+    function isVisible(element) {
+        const rect = element.getBoundingClientRect();
+        return (
+            rect.bottom > 0 &&
+            rect.top < window.innerHeight &&
+            rect.width > 0 &&
+            rect.height > 0
+        );
+    }
+
+    function* highlightSteps(roots, terms, observeEdits) {
+        for (const [root, ordinal] of roots) {
+            // fields searched for the same terms share their pattern
+            const pattern = getPattern(
+                terms.filter(
+                    (term) => !term.fields || term.fields.includes(ordinal)
+                )
+            );
+            if (!pattern) {
+                continue;
+            }
+
+            rootPatterns.set(root, pattern);
+            if (observeEdits) {
+                observe(root);
+            }
+
+            let spent = 0;
+            for (const textNode of textNodes(root)) {
+                const started = performance.now();
+                wrapMatches(textNode, pattern, started + FIELD_BUDGET_MS - spent);
+                spent += performance.now() - started;
+                if (spent >= FIELD_BUDGET_MS) {
+                    console.warn("Highlighting search results took too long");
+                    break;
+                }
+                yield;
+            }
+        }
+    }
+
+    function scheduleChunk(callback) {
+        if (window.requestIdleCallback) {
+            requestIdleCallback(callback, { timeout: 100 });
+        } else {
+            requestAnimationFrame(() => callback(null));
+        }
+    }
+
+    /*
+     * Works through the steps in time-sliced chunks, so that highlighting
+     * very large fields does not block the page. Stops as soon as another
+     * pass is started or highlights are cleared.
+     */
+    function runPass(steps) {
+        const pass = currentPass;
+
+        const runChunk = (deadline) => {
+            if (pass !== currentPass) {
+                return;
+            }
+            const budget =
+                deadline && !deadline.didTimeout
+                    ? deadline.timeRemaining()
+                    : CHUNK_BUDGET_MS;
+            const end = performance.now() + budget;
+            let done = false;
+            do {
+                done = steps.next().done;
+            } while (!done && performance.now() < end);
+            // mutation records queued up to here were all caused by the pass
+            ignoreOwnMutations();
+            if (!done) {
+                scheduleChunk(runChunk);
+            }
+        };
+
+        // first chunk runs right away, so that visible matches show up first
+        runChunk(null);
+    }
+
+    /*
+     * terms: [{text: string, fields: number[] | null, regex: boolean}], with
+     * fields listing the ordinals of the fields a term is limited to, if any,
+     * and regex marking text as the source of a regular expression
+     *
+     * options.scope: "fields" (default) to only search editor fields, or
+     * "document" to search the whole page, ignoring the terms' field limits
+     */
+    function highlight(terms, options) {
+        clear();
+        const scope = options.scope || "fields";
+
+        if (scope === "document") {
+            terms = terms.map((term) => ({ ...term, fields: null }));
+        }
+
+        const roots = [];
+        findRoots(scope).forEach((root, ordinal) => {
+            if (root) {
+                roots.push([root, ordinal]);
+            }
+        });
+        // fields in view first
+        const visible = roots.map(([root]) => isVisible(root));
+        const order = roots.map((_, index) => index);
+        order.sort((a, b) => visible[b] - visible[a] || a - b);
+
+        // whole pages are replaced rather than edited when they change
+        const observeEdits = scope !== "document";
+        runPass(
+            highlightSteps(
+                order.map((index) => roots[index]),
+                terms,
+                observeEdits
+            )
+        );
+    }
+
+    window.HighlightSearchResults = {
+        version: VERSION,
+        highlight: function (terms, options) {
+            clearTimeout(pendingHighlight);
+            // let the editor finish rendering the note that was just loaded
+            pendingHighlight = setTimeout(() => highlight(terms, options || {}), 0);
+        },
+        clear: function () {
+            clearTimeout(pendingHighlight);
+            clear();
+        },
+    };
+})();
@@ -29,17 +29,144 @@
 #
 # Any modifications to this file must keep this entire header intact.
 
-from typing import List
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
 
-from aqt.webview import AnkiWebView
+from aqt import mw
+from aqt.editor import Editor
+from aqt.webview import AnkiWebView, WebContent
+
+try:
+    # Anki 2.1.45+
+    from aqt.browser.previewer import Previewer
+except (ImportError, ModuleNotFoundError):
+    from aqt.previewer import Previewer
+
+from .markup import strip_highlights
+from .search import SearchTerm, SearchTermKind, get_field_ordinals
+
+# needs to be kept in sync with VERSION in web/highlighter.js
+HIGHLIGHTER_VERSION = 5
+
+_HIGHLIGHTER_PATH = "web/highlighter.js"
+_HIGHLIGHTER_SCRIPT = (Path(__file__).parent / _HIGHLIGHTER_PATH).read_text(
+    encoding="utf-8"
+)
+
+# runs the given call if the current version of the highlighter is installed,
+# returning whether it was
+_HIGHLIGHTER_CALL_TEMPLATE = """\
+(function () {{
+    const highlighter = window.HighlightSearchResults;
+    if (!highlighter || highlighter.version !== {version}) {{
+        return false;
+    }}
+    {call};
+    return true;
+}})();"""
+
+def _serialize_terms(
+    terms: Sequence[SearchTerm], field_names: Sequence[str]
+) -> List[Dict[str, Any]]:
+    serialized_terms = []
 
-def highlight_terms(webview: AnkiWebView, terms: List[str]):
-    # FIXME: anki21 does not seem to support highlighting more than one
-    # term at once. Likely a Qt bug / regression.
-    # TODO: Perhaps choose to highlight the longest term on anki21.
-    # TODO: Find a way to exclude UI text in editor pane from highlighting
     for term in terms:
-        webview.findText(term)
+        if term.field is None:
+            fields = None
+        else:
+            fields = get_field_ordinals(term.field, field_names)
+            if not fields:
+                # not searched in any field of this note
+                continue
+
+        serialized_terms.append(
+            {
+                "text": term.text,
+                "fields": fields,
+                "regex": term.kind == SearchTermKind.REGEX,
+            }
+        )
+
+    return serialized_terms
+
+
+def _guard_call(call: str) -> str:
+    return _HIGHLIGHTER_CALL_TEMPLATE.format(version=HIGHLIGHTER_VERSION, call=call)
+
+
+def _call_highlighter(webview: AnkiWebView, call: str):
+    """
+    Run call against the highlighter installed in the web view, installing
+    it first if it is missing (e.g. because the page was reloaded)
+    """
+
+    guarded_call = _guard_call(call)
+
+    def on_result(installed: Optional[bool]):
+        if not installed:
+            webview.eval("{}\n{}".format(_HIGHLIGHTER_SCRIPT, guarded_call))
+
+    webview.evalWithCallback(guarded_call, on_result)
+
+
+def _highlight_call(
+    terms: Sequence[SearchTerm], field_names: Sequence[str], scope: str
+) -> str:
+    return "highlighter.highlight({terms}, {options})".format(
+        terms=json.dumps(_serialize_terms(terms, field_names)),
+        options=json.dumps({"scope": scope}),
+    )
+
+
+def highlight_terms(
+    webview: AnkiWebView,
+    terms: Sequence[SearchTerm],
+    field_names: Sequence[str],
+    scope: str = "fields",
+):
+    """
+    Highlight all terms at once in the fields of the editor, using a single
+    round trip to the web view
+
+    Terms limited to a field are only highlighted in the fields among
+    field_names that they match. Pass scope="document" to search the entire
+    page of web views that do not display editor fields.
+    """
+    _call_highlighter(webview, _highlight_call(terms, field_names, scope))
+
+
+def highlight_script(
+    terms: Sequence[SearchTerm], field_names: Sequence[str], scope: str = "document"
+) -> str:
+    """
+    Return JS highlighting terms in a page that has the highlighter
+    installed, for pages that run scripts of their own once rendered
+    """
+    return _guard_call(_highlight_call(terms, field_names, scope))
+
 
 def clear_highlights(webview: AnkiWebView):
-    webview.findText("")
+    webview.eval("window.HighlightSearchResults && HighlightSearchResults.clear();")
+
+
+def on_editor_will_munge_html(html: str, editor: Editor) -> str:
+    # highlights are wrapped around field contents, so make sure that they
+    # never make it into the saved note
+    return strip_highlights(html)
+
+
+def on_webview_will_set_content(web_content: WebContent, context: Optional[Any]):
+    if not isinstance(context, (Editor, Previewer)):
+        return
+    addon_package = mw.addonManager.addonFromModule(__name__)
+    web_content.js.append("/_addons/{}/{}".format(addon_package, _HIGHLIGHTER_PATH))
+
+
+def initialize_webview():
+    from aqt.gui_hooks import editor_will_munge_html, webview_will_set_content
+
+    mw.addonManager.setWebExports(__name__, r"web/.*\.js")
+
+    editor_will_munge_html.append(on_editor_will_munge_html)
+    webview_will_set_content.append(on_webview_will_set_content)
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+
+# Highlight Search Results in the Browser Add-on for Anki
+#
+# Copyright (C) 2017-2020  Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+
+"""
+Throughput benchmarks for the search tokenizer and term extraction
+
+Run from the repository root:
+
+    python tests/benchmarks/bench_search.py                  # report only
+    python tests/benchmarks/bench_search.py --check          # compare to baseline
+    python tests/benchmarks/bench_search.py --save-baseline  # update baseline
+
+Results are normalized against a fixed pure-Python calibration workload
+so that baselines recorded on one machine remain roughly comparable on
+another. --check exits with a non-zero status if any benchmark is slower
+than its baseline by more than the given tolerance.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "src"))
+os.environ["PYTEST_ANKI_SKIP_ADDON_INIT"] = "True"
+
+from highlight_search_results.query import parse_query  # noqa: E402
+from highlight_search_results.search import (  # noqa: E402
+    QueryLanguageVersion,
+    SearchTokenizer,
+)
+
+BASELINE_PATH = Path(__file__).parent / "baseline.json"
+MIN_DURATION = 0.1  # seconds per measurement round
+ROUNDS = 5  # best round is reported, to filter out scheduling noise
+
+
+def _short_queries(rng: random.Random) -> List[str]:
+    words = ["dog", "cat", "house", "tree", "'two words'", "-is:suspended", "or"]
+    prefixes = ["", "", "deck:", "tag:", "front:", "-"]
+    return [
+        " ".join(
+            rng.choice(prefixes) + rng.choice(words) for _ in range(rng.randint(1, 5))
+        )
+        for _ in range(50)
+    ]
+
+
+def _long_pastes(rng: random.Random) -> List[str]:
+    words = ["the", "mitochondria", "is", "powerhouse", "of", "cell", "{{c1::x}}"]
+    queries = []
+    for _ in range(3):
+        query = ""
+        while len(query) < 10000:
+            query += rng.choice(words) + rng.choice([" ", ", ", ". ", " "])
+        queries.append(query[:10000])
+    return queries
+
+
+def _nested_parentheses(rng: random.Random) -> List[str]:
+    return [
+        "(" * depth
+        + " or ".join("term{}".format(i) for i in range(depth))
+        + ")" * depth
+        for depth in (10, 100, 500)
+    ]
+
+
+def _field_prefixes(rng: random.Random) -> List[str]:
+    return [
+        " ".join(
+            "field{}:value{}".format(i, rng.randint(0, 1000)) for i in range(count)
+        )
+        for count in (10, 100, 300)
+    ]
+
+
+def _cjk_text(rng: random.Random) -> List[str]:
+    characters = "漢字仮名交じり文日本語中文한국어"
+    return [
+        "　".join(
+            "".join(rng.choice(characters) for _ in range(rng.randint(1, 6)))
+            for _ in range(count)
+        )
+        for count in (5, 50, 500)
+    ]
+
+
+CORPORA: Dict[str, Callable[[random.Random], List[str]]] = {
+    "short": _short_queries,
+    "paste_10k": _long_pastes,
+    "nested": _nested_parentheses,
+    "field_prefixes": _field_prefixes,
+    "cjk": _cjk_text,
+}
+
+
+def _calibrate() -> float:
+    """Ops/sec of a fixed workload used to normalize results across machines"""
+
+    def workload():
+        total = 0
+        for i in range(1000):
+            total += len(str(i))
+        return total
+
+    return _measure_throughput(workload)
+
+
+def _measure_throughput(func: Callable[[], object]) -> float:
+    """Return the number of calls to func per second in the fastest round"""
+    best = 0.0
+    for _ in range(ROUNDS):
+        iterations = 0
+        start = time.perf_counter()
+        elapsed = 0.0
+        while elapsed < MIN_DURATION:
+            func()
+            iterations += 1
+            elapsed = time.perf_counter() - start
+        best = max(best, iterations / elapsed)
+    return best
+
+
+def _measure_allocations(func: Callable[[Any], object], items: List[Any]) -> float:
+    """Return the mean peak number of bytes allocated by one call to func"""
+    total = 0
+    tracemalloc.start()
+    for item in items:
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        func(item)
+        _, peak = tracemalloc.get_traced_memory()
+        total += peak - current
+    tracemalloc.stop()
+    return total / len(items)
+
+
+def _benchmark(func: Callable[[Any], object], items: List[Any]) -> Dict[str, float]:
+    def run_all():
+        for item in items:
+            func(item)
+
+    queries_per_sec = _measure_throughput(run_all) * len(items)
+    return {
+        "queries_per_sec": queries_per_sec,
+        "peak_bytes_per_query": _measure_allocations(func, items),
+        "normalized": queries_per_sec / _CALIBRATION,
+    }
+
+
+def run_benchmarks() -> Dict[str, Dict[str, float]]:
+    results: Dict[str, Dict[str, float]] = {}
+
+    for corpus_name, factory in CORPORA.items():
+        queries = factory(random.Random(corpus_name))
+
+        tokenizer = SearchTokenizer(QueryLanguageVersion.ANKI2124)
+        results["tokenize/{}".format(corpus_name)] = _benchmark(
+            tokenizer.tokenize, queries
+        )
+        results["get_searchable_tokens/{}".format(corpus_name)] = _benchmark(
+            tokenizer.get_searchable_tokens,
+            [tokenizer.tokenize(query) for query in queries],
+        )
+
+        results["scan/{}".format(corpus_name)] = _benchmark(tokenizer.scan, queries)
+        results["get_searchable_terms/{}".format(corpus_name)] = _benchmark(
+            tokenizer.get_searchable_terms,
+            [tokenizer.scan(query) for query in queries],
+        )
+        results["parse/{}".format(corpus_name)] = _benchmark(
+            lambda query: parse_query(tokenizer, query), queries
+        )
+
+    return results
+
+
+def check_against_baseline(
+    results: Dict[str, Dict[str, float]], tolerance: float
+) -> List[str]:
+    baseline = json.loads(BASELINE_PATH.read_text(encoding="utf-8"))
+    failures = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        expected = baseline[name]["normalized"]
+        if result["normalized"] < expected * (1 - tolerance):
+            failures.append(
+                "{}: {:.1%} of baseline throughput".format(
+                    name, result["normalized"] / expected
+                )
+            )
+    return failures
+
+
+_CALIBRATION = _calibrate()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.3,
+        help="allowed relative slowdown before --check fails (default: 0.3)",
+    )
+    args = parser.parse_args()
+
+    results = run_benchmarks()
+
+    for name, result in results.items():
+        print(
+            "{:<45} {:>12,.0f} queries/s {:>12,.0f} peak B/query".format(
+                name, result["queries_per_sec"], result["peak_bytes_per_query"]
+            )
+        )
+
+    if args.save_baseline:
+        BASELINE_PATH.write_text(
+            json.dumps(results, indent=2, sort_keys=True) + "\n", encoding="utf-8"
+        )
+        print("Saved baseline to {}".format(BASELINE_PATH))
+
+    if args.check:
+        failures = check_against_baseline(results, args.tolerance)
+        if failures:
+            print("\nSlower than baseline:\n" + "\n".join(failures))
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+# Highlight Search Results in the Browser Add-on for Anki
+#
+# Copyright (C) 2017-2020  Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+def test_collection_changes(mock_skip_addon_init):
+
+    from types import SimpleNamespace
+
+    from highlight_search_results.changes import (
+        CollectionChanges,
+        collection_changes,
+        on_operation_did_execute,
+    )
+    from highlight_search_results.matches import MatchList, MatchListCache
+
+    changes = CollectionChanges()
+    cache = MatchListCache()
+    changes.register(cache.clear)
+
+    cache.put(("dog", changes.generation), MatchList([1, 2]))
+    changes.invalidate()
+    assert changes.generation == 1
+    assert cache.get(("dog", 0)) is None
+
+    changes.unregister(cache.clear)
+    cache.put(("dog", changes.generation), MatchList([1, 2]))
+    changes.invalidate()
+    assert cache.get(("dog", 1)) is not None
+
+    # operations only count if they could affect search results
+    generation = collection_changes.generation
+    unrelated = SimpleNamespace(browser_table=False, note_text=False, card=False)
+    on_operation_did_execute(unrelated, None)
+    assert collection_changes.generation == generation
+    on_operation_did_execute(SimpleNamespace(card=True), None)
+    assert collection_changes.generation == generation + 1
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+# Highlight Search Results in the Browser Add-on for Anki
+#
+# Copyright (C) 2017-2020  Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+def test_strip_highlights(mock_skip_addon_init):
+
+    from highlight_search_results.markup import strip_highlights
+
+    mark = '<span class="hsr-highlight" style="background-color: #ffff00;">'
+
+    assert strip_highlights("a dog") == "a dog"
+    assert strip_highlights("a {}dog</span>!".format(mark)) == "a dog!"
+    assert (
+        strip_highlights(
+            '<span style="color: red">{}d<span style="color: blue">o</span>g'
+            "</span></span> {}cat</span>".format(mark, mark)
+        )
+        == '<span style="color: red">d<span style="color: blue">o</span>g</span> cat'
+    )
+    # unbalanced markup is left alone, apart from the markers
+    assert strip_highlights("</span>{}dog".format(mark)) == "</span>dog"
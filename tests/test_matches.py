@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+# Highlight Search Results in the Browser Add-on for Anki
+#
+# Copyright (C) 2017-2020  Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+def test_match_list_lookup(mock_skip_addon_init):
+
+    from highlight_search_results.matches import MatchList
+
+    matches = MatchList([30, 10, 20])
+
+    assert len(matches) == 3
+    assert 10 in matches and 40 not in matches
+    assert matches.position(20) == 2
+    assert matches.position(40) is None
+
+    assert list(matches) == [30, 10, 20]
+    assert matches[1] == 10
+
+
+def test_match_list_rows(mock_skip_addon_init):
+
+    import random
+
+    from highlight_search_results.matches import MatchList
+
+    rng = random.Random(0)
+    row_item_ids = rng.sample(range(10 ** 6), 1000)
+
+    for count in (0, 1, 10, 500):
+        item_ids = rng.sample(row_item_ids, count) + [-1, 10 ** 7]
+        matches = MatchList(item_ids)
+
+        assert matches.rows_in(row_item_ids) == [
+            row for row, item_id in enumerate(row_item_ids) if item_id in item_ids
+        ]
+        for position, item_id in enumerate(item_ids):
+            assert matches.position(item_id) == position
+        assert matches.position(10 ** 6) is None
+        assert "1" not in matches
+
+
+def test_match_list_cache(mock_skip_addon_init):
+
+    from highlight_search_results.matches import MatchList, MatchListCache
+
+    cache = MatchListCache()
+    matches = MatchList([1, 2, 3])
+
+    assert cache.get(("deck:current", 1)) is None
+    cache.put(("deck:current", 1), matches)
+    assert cache.get(("deck:current", 1)) is matches
+    assert cache.get(("deck:current", 2)) is None
+
+    cache.clear()
+    assert cache.get(("deck:current", 1)) is None
+
+
+def test_find_next_row(mock_skip_addon_init):
+
+    from highlight_search_results.matches import MatchList, find_next_row
+
+    row_item_ids = [10, 20, 30, 40]
+    matches = MatchList([40, 20])
+
+    assert find_next_row(row_item_ids, -1, matches) == 1
+    assert find_next_row(row_item_ids, 1, matches) == 3
+    # wraps around at the end
+    assert find_next_row(row_item_ids, 3, matches) == 1
+    assert find_next_row(row_item_ids, 1, MatchList([20])) == 1
+    assert find_next_row(row_item_ids, 0, MatchList([50])) is None
+    assert find_next_row([], -1, matches) is None
+
+
+def test_row_ranges(mock_skip_addon_init):
+
+    from highlight_search_results.matches import merge_ranges, rows_to_ranges
+
+    assert rows_to_ranges([]) == []
+    assert rows_to_ranges([5, 1, 2, 3, 7, 8]) == [(1, 3), (5, 5), (7, 8)]
+    assert merge_ranges([(4, 6), (0, 2), (3, 3), (8, 9)]) == [(0, 6), (8, 9)]
+
+
+def test_match_spans(mock_skip_addon_init):
+
+    from highlight_search_results.matches import compile_terms, find_match_spans
+    from highlight_search_results.search import SearchTerm, SearchTermKind
+
+    terms = (
+        SearchTerm("cat"),
+        SearchTerm("catalog"),
+        SearchTerm("café"),
+        SearchTerm("\u0915"),
+        SearchTerm("na"),
+        SearchTerm("nai"),
+        SearchTerm(r"d\S\p{M}*g", None, SearchTermKind.REGEX),
+        SearchTerm("house", "front"),
+    )
+    pattern = compile_terms(terms)
+    assert compile_terms(terms) is pattern
+
+    # composed and decomposed accents match alike
+    text = "Catalog: cat, dog, house, caf\u00e9, cafe\u0301, cafe"
+    assert [text[start:end] for start, end in find_match_spans(pattern, text)] == [
+        "Catalog",
+        "cat",
+        "caf\u00e9",
+        "cafe\u0301",
+    ]
+
+    # matches never end in the middle of a character, falling back to shorter
+    # terms, also for marks outside the combining diacritics blocks
+    text = "\u0915\u093f \u0915 na\u00efve"
+    assert [text[start:end] for start, end in find_match_spans(pattern, text)] == [
+        "\u0915",
+        "na",
+    ]
+
+    # regular expressions could take unbounded time to match while painting
+    assert compile_terms((SearchTerm("d.g", None, SearchTermKind.REGEX),)) is None
+
+    # terms limited to a field cannot be told apart in a single text
+    assert compile_terms((SearchTerm("house", "front"),)) is None
+
+
+def test_match_span_cache(mock_skip_addon_init):
+
+    from highlight_search_results.matches import MatchSpanCache, compile_terms
+    from highlight_search_results.search import SearchTerm
+
+    terms = (SearchTerm("dog"),)
+    pattern = compile_terms(terms)
+    cache = MatchSpanCache(maxsize=2)
+
+    assert cache.get_spans((1, "question", terms), "a dog", pattern) == ((2, 5),)
+    assert cache.get_spans((1, "question", terms), "a dog", pattern) == ((2, 5),)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # edited items are searched again
+    assert cache.get_spans((1, "question", terms), "dog", pattern) == ((0, 3),)
+    assert cache.misses == 2
+
+    cache.get_spans((2, "question", terms), "", pattern)
+    cache.get_spans((3, "question", terms), "", pattern)
+    assert len(cache) == 2
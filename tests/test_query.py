@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+# Highlight Search Results in the Browser Add-on for Anki
+#
+# Copyright (C) 2017-2020  Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+def test_parse_query(mock_skip_addon_init):
+
+    from highlight_search_results.query import (
+        AndNode,
+        NotNode,
+        TermNode,
+        iter_terms,
+        parse_query,
+    )
+    from highlight_search_results.search import SearchTokenizer, QueryLanguageVersion
+
+    tokenizer = SearchTokenizer(QueryLanguageVersion.ANKI2124)
+
+    def shape(node):
+        if isinstance(node, TermNode):
+            return node.token.text
+        if isinstance(node, NotNode):
+            return ("not", shape(node.child))
+        name = "and" if isinstance(node, AndNode) else "or"
+        return (name,) + tuple(shape(child) for child in node.children)
+
+    assert shape(parse_query(tokenizer, "a b or c and d")) == (
+        "or",
+        ("and", "a", "b"),
+        ("and", "c", "d"),
+    )
+    assert shape(parse_query(tokenizer, "a -(b or -front:c) 'or'")) == (
+        "and",
+        "a",
+        ("not", ("or", "b", ("not", "front:c"))),
+        "or",
+    )
+    assert shape(parse_query(tokenizer, "")) == ("and",)
+
+    # malformed queries are parsed leniently
+    assert shape(parse_query(tokenizer, ") a (b or -")) == (
+        "and",
+        "a",
+        ("or", "b", ("and",)),
+    )
+    deeply_nested = parse_query(tokenizer, "(" * 5000 + "a" + ")" * 5000)
+    assert [node.token.text for node in iter_terms(deeply_nested)] == ["a"]
+
+
+def test_negated_terms_are_not_highlighted(mock_skip_addon_init):
+
+    from highlight_search_results.query import SearchTermsCache
+    from highlight_search_results.search import SearchTokenizer, QueryLanguageVersion
+
+    cache = SearchTermsCache(SearchTokenizer(QueryLanguageVersion.ANKI2124))
+
+    def texts(query):
+        return [term.text for term in cache.get_terms(query)]
+
+    assert texts("one -two") == ["one"]
+    assert texts("one -(two or front:three) four") == ["one", "four"]
+    assert texts("-(-one two)") == ["one"]
+    assert texts("one or -two and three") == ["one", "three"]
+
+
+def test_query_parser_cache(mock_skip_addon_init):
+
+    from highlight_search_results.query import QueryParser
+    from highlight_search_results.search import SearchTokenizer, QueryLanguageVersion
+
+    tokenizer = SearchTokenizer(QueryLanguageVersion.ANKI2124)
+    parser = QueryParser(tokenizer, 2)
+
+    tree = parser.parse("a -b")
+    assert parser.parse("a -b") is tree
+    assert (parser.hits, parser.misses) == (1, 1)
+
+    parser.parse("c")
+    parser.parse("d")
+    assert len(parser) == 2
+    assert parser.parse("a -b") is not tree
+
+    # registering rules changes how queries are tokenized
+    tokenizer.register_operator("||")
+    assert len(parser) == 2
+    parser.parse("a || b")
+    assert len(parser) == 1
@@ -80,3 +80,422 @@ def test_tokenization_2124(mock_skip_addon_init):
     _assert_common_tokenizations(tokenizer)
     # assert tokenizer.tokenize("'hello \"world\"'") == ['hello "world"']
     # assert tokenizer.tokenize("deck:'two words'") == ["deck:two words"]
+
+
+_DIFFERENTIAL_CORPUS = [
+    "",
+    " ",
+    "hello world",
+    "　hello　world　",
+    "one -two",
+    "one --two -(three or four)",
+    "-",
+    "a-b-c",
+    '"-quoted dash"',
+    '"unterminated quote',
+    "'single quoted'",
+    "deck:'two words' tag:\"a b\"",
+    "front:\"(nested) text\"",
+    "embedded'string embedded\"string",
+    "escaped\\ space",
+    "escaped\\\\backslash",
+    '\\"quote\\"',
+    '"in \\" quote"',
+    "a(b)c",
+    "((a))",
+    "re:\\d+ nc:uber",
+    "*wild_card* _ _*",
+]
+
+
+def _random_queries(count: int, seed: int = 0):
+    import random
+
+    rng = random.Random(seed)
+    alphabet = [
+        "a",
+        "b",
+        "é",
+        "字",
+        " ",
+        "　",
+        '"',
+        "'",
+        "\\",
+        "(",
+        ")",
+        "-",
+        ":",
+        "*",
+        "_",
+        "or",
+        "deck:",
+    ]
+    for _ in range(count):
+        yield "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+
+
+def test_search_terms_cache(mock_skip_addon_init):
+
+    from highlight_search_results.query import SearchTermsCache
+    from highlight_search_results.search import (
+        SearchTerm,
+        SearchTokenizer,
+        QueryLanguageVersion,
+    )
+
+    cache = SearchTermsCache(SearchTokenizer(QueryLanguageVersion.ANKI2124), 2)
+
+    assert cache.get_terms("one two -three deck:four") == (
+        SearchTerm("one"),
+        SearchTerm("two"),
+    )
+    assert cache.get_terms("one two -three deck:four") == (
+        SearchTerm("one"),
+        SearchTerm("two"),
+    )
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # NFD input is normalized to NFC before tokenizing
+    assert cache.get_terms("cafe\u0301") == (SearchTerm("caf\u00e9"),)
+    cache.get_terms("four")
+    assert len(cache) == 2
+
+    # least recently used entry was evicted
+    cache.get_terms("one two -three deck:four")
+    assert (cache.hits, cache.misses) == (1, 4)
+
+    cache.tokenizer = SearchTokenizer(QueryLanguageVersion.ANKI2100)
+    assert len(cache) == 0
+
+
+def test_scan_matches_tokenize(mock_skip_addon_init):
+
+    from highlight_search_results.search import SearchTokenizer, QueryLanguageVersion
+
+    for version in QueryLanguageVersion:
+        tokenizer = SearchTokenizer(version)
+
+        for query in _DIFFERENTIAL_CORPUS + list(_random_queries(2000)):
+            tokens = tokenizer.scan(query)
+            assert [token.text for token in tokens] == tokenizer.tokenize(query)
+            for token in tokens:
+                if token.verbatim:
+                    assert query[token.start : token.end] == token.text
+
+
+def test_scan_token_records(mock_skip_addon_init):
+
+    from highlight_search_results.search import (
+        SearchTokenizer,
+        QueryLanguageVersion,
+        TokenKind,
+    )
+
+    tokenizer = SearchTokenizer(QueryLanguageVersion.ANKI2124)
+    query = "-(front:\"a b\" or back:c) 'and'"
+    tokens = tokenizer.scan(query)
+
+    assert [token.kind for token in tokens] == [
+        TokenKind.NEGATION,
+        TokenKind.PAREN,
+        TokenKind.TERM,
+        TokenKind.OPERATOR,
+        TokenKind.TERM,
+        TokenKind.PAREN,
+        TokenKind.TERM,
+    ]
+
+    front, back, quoted_operator = tokens[2], tokens[4], tokens[6]
+
+    assert (front.field, front.value, front.raw_value) == ("front", "a b", "a b")
+    assert query[front.start : front.end] == 'front:"a b"'
+    assert not front.verbatim
+
+    assert (back.field, back.value, back.raw_value) == ("back", "c", "c")
+    assert back.verbatim and back.value_start == 5
+    assert front.value_start == 6
+    assert tokens[1].value_start == 0 and tokens[1].field is None
+
+    assert (quoted_operator.text, quoted_operator.verbatim) == ("and", False)
+
+    def values(tokens):
+        return [term.text for term in tokenizer.get_searchable_terms(tokens)]
+
+    assert values(tokens) == ["a b", "c", "and"]
+    assert values(tokenizer.scan("one -two deck:three front: tag:x is:due *")) == [
+        "one",
+        "two",
+    ]
+
+
+def test_register_ignored_tags(mock_skip_addon_init):
+
+    import pytest
+
+    from highlight_search_results.query import SearchTermsCache
+    from highlight_search_results.search import SearchTokenizer, QueryLanguageVersion
+
+    tokenizer = SearchTokenizer(QueryLanguageVersion.ANKI2124)
+    cache = SearchTermsCache(tokenizer)
+    query = "source:book front:dog cat || x"
+
+    assert [term.text for term in cache.get_terms(query)] == [
+        "book",
+        "dog",
+        "cat",
+        "||",
+        "x",
+    ]
+
+    revision = tokenizer.revision
+    tokenizer.register_ignored_tag("source:")
+    tokenizer.register_ignored_tag("front")
+    tokenizer.register_operator("||")
+    # registering existing rules is a no-op
+    tokenizer.register_ignored_tag("deck:")
+    assert tokenizer.revision == revision + 3
+
+    # cache picks up the new rules
+    assert [term.text for term in cache.get_terms(query)] == ["cat", "x"]
+    assert tokenizer.get_searchable_tokens(tokenizer.tokenize(query)) == ["cat", "x"]
+
+    for invalid_tag in ("", ":", "a:b:"):
+        with pytest.raises(ValueError):
+            tokenizer.register_ignored_tag(invalid_tag)
+
+
+def test_query_grammars_are_shared(mock_skip_addon_init):
+
+    import dataclasses
+
+    import pytest
+
+    from highlight_search_results.search import (
+        QUERY_GRAMMARS,
+        SearchTokenizer,
+        QueryLanguageVersion,
+    )
+
+    assert set(QUERY_GRAMMARS) == set(QueryLanguageVersion)
+
+    grammar = QUERY_GRAMMARS[QueryLanguageVersion.ANKI2124]
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        grammar.escape_supported = False  # type: ignore
+
+    first = SearchTokenizer(QueryLanguageVersion.ANKI2124)
+    second = SearchTokenizer(QueryLanguageVersion.ANKI2124)
+    assert first._ignored_fields is second._ignored_fields is grammar.ignored_fields
+
+    # rules registered on one tokenizer do not leak into the shared tables
+    first.register_ignored_tag("source:")
+    assert "source" in first._ignored_fields
+    assert "source" not in second._ignored_fields
+    assert "source" not in grammar.ignored_fields
+
+
+def test_field_scoped_terms(mock_skip_addon_init):
+
+    from highlight_search_results.search import (
+        SearchTerm,
+        SearchTokenizer,
+        QueryLanguageVersion,
+        get_field_ordinals,
+    )
+
+    tokenizer = SearchTokenizer(QueryLanguageVersion.ANKI2124)
+
+    assert tokenizer.get_searchable_terms(
+        tokenizer.scan("dog front:cat 'back:two words'")
+    ) == [
+        SearchTerm("dog"),
+        SearchTerm("cat", "front"),
+        SearchTerm("two words", "back"),
+    ]
+
+    field_names = ["Front", "Back", "Back Extra", "Source"]
+
+    assert get_field_ordinals("front", field_names) == [0]
+    assert get_field_ordinals("back*", field_names) == [1, 2]
+    assert get_field_ordinals("*o*", field_names) == [0, 3]
+    assert get_field_ordinals("b.ck", field_names) == []
+    assert get_field_ordinals("missing", field_names) == []
+
+
+def test_regex_terms(mock_skip_addon_init):
+
+    import warnings
+
+    from highlight_search_results.search import (
+        SearchTerm,
+        SearchTermKind,
+        SearchTokenizer,
+        QueryLanguageVersion,
+    )
+    from highlight_search_results.regex_terms import translate_regex
+
+    tokenizer = SearchTokenizer(QueryLanguageVersion.ANKI2124)
+
+    def regex_terms(query):
+        return [
+            (term.text, term.field)
+            for term in tokenizer.get_searchable_terms(tokenizer.scan(query))
+            if term.kind == SearchTermKind.REGEX
+        ]
+
+    # escapes are retained, unlike for plain search terms
+    assert regex_terms(r"re:\d+ 're:a b' re:\"x\"") == [
+        (r"\d+", None),
+        ("a b", None),
+        ('"x"', None),
+    ]
+    assert regex_terms('"front:re:(?i)(cat|dog)s?"') == [("(cat|dog)s?", "front")]
+    assert regex_terms('"re:(?P<name>x)"') == [("(?:x)", None)]
+
+    # invalid, untranslatable, and backtracking-prone patterns are dropped
+    for query in ("re:[", "re:x*", '"re:(?-i)x"', '"re:(a+)+"', r'"re:(\w+\s?)*"'):
+        assert regex_terms(query) == [], query
+    assert regex_terms('"re:(ab)+c*"') == [("(ab)+c*", None)]
+
+    # so are alternatives and optional items that could match the same
+    # character within unbounded repetitions, and variable-length items
+    # next to each other that could
+    for pattern in (
+        "(a|aa)+b",
+        r"(\d|\d\d)+x",
+        "(a?a)+",
+        "(.|a)+",
+        "(a|b?)+",
+        ".*.*.*x",
+        r"\w*\w*\w*\w*\w*!",
+        "a?" * 28 + "a" * 28,
+        "(a|aa)(a|aa)b",
+    ):
+        assert translate_regex(pattern) is None, pattern
+    for pattern in (
+        "(a|b)+c",
+        "(ab?)+",
+        "(a?b)+",
+        r"([^a]x|ay)+",
+        "(cat|dog)s?",
+        "foo.*bar",
+        r"\d+(?:\.\d+)?",
+    ):
+        assert translate_regex(pattern) == pattern, pattern
+
+    # patterns that are long enough to make checking them slow are dropped
+    assert translate_regex("(?:[a-z]x)+" + "[a-z]?" * 200) is None
+
+    # ambiguous, but valid patterns are accepted silently
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert translate_regex("[[a]") == "[[a]"
+
+    # the highlighter matches decomposed text, so accented characters are
+    # decomposed outside of character classes, and grouped for quantifiers
+    assert translate_regex("caf\u00e9+") == "caf(?:e\u0301)+"
+    assert translate_regex("[\u00e0-\u00ff]\u00fc") == "[\u00e0-\u00ff]u\u0308"
+    assert translate_regex("\\\u00e9|[]\u00e9]") == "e\u0301|[]\u00e9]"
+
+    # older versions of the query language search the "re" field instead
+    legacy_tokenizer = SearchTokenizer(QueryLanguageVersion.ANKI2100)
+    assert legacy_tokenizer.get_searchable_terms(legacy_tokenizer.scan("re:x")) == [
+        SearchTerm("x", "re")
+    ]
+
+
+def test_wildcard_terms(mock_skip_addon_init):
+
+    from highlight_search_results.search import (
+        SearchTerm,
+        SearchTermKind,
+        SearchTokenizer,
+        QueryLanguageVersion,
+    )
+
+    tokenizer = SearchTokenizer(QueryLanguageVersion.ANKI2124)
+
+    def terms(query):
+        return tokenizer.get_searchable_terms(tokenizer.scan(query))
+
+    assert terms("th*ory front:d_g") == [
+        SearchTerm(r"th(?:[^\so]|o(?!ry(?!\p{M})))*ory", None, SearchTermKind.REGEX),
+        SearchTerm(r"d\S\p{M}*g", "front", SearchTermKind.REGEX),
+    ]
+    # special characters are escaped, runs of "*" collapsed
+    assert terms("x.y**z") == [
+        SearchTerm(r"x\.y(?:[^\sz]|z(?=\p{M}))*z", None, SearchTermKind.REGEX)
+    ]
+    # "*" skip to the first place where the text up to the next "*" matches
+    assert terms("a*b_c*-") == [
+        SearchTerm(
+            r"a(?:[^\sb]|b(?!\S\p{M}*c))*b\S\p{M}*c(?:[^\s\-]|-(?=\p{M}))*-",
+            None,
+            SearchTermKind.REGEX,
+        )
+    ]
+
+    # outer "*" are implied, and escaped wildcards are literal text
+    assert terms(r"*dog* th\*ory a\_b") == [
+        SearchTerm("dog"),
+        SearchTerm("th*ory"),
+        SearchTerm("a_b"),
+    ]
+
+    # terms consisting only of wildcards match anything
+    assert terms("_ * _* front:_*") == []
+
+    # escapes are not part of the older query language
+    legacy_tokenizer = SearchTokenizer(QueryLanguageVersion.ANKI2100)
+    assert legacy_tokenizer.get_searchable_terms(legacy_tokenizer.scan(r"a\*b")) == [
+        SearchTerm(r"a\\(?:[^\sb]|b(?=\p{M}))*b", None, SearchTermKind.REGEX)
+    ]
+
+
+def test_no_combining_terms(mock_skip_addon_init):
+
+    from highlight_search_results.search import (
+        SearchTerm,
+        SearchTermKind,
+        SearchTokenizer,
+        QueryLanguageVersion,
+    )
+
+    tokenizer = SearchTokenizer(QueryLanguageVersion.ANKI2124)
+
+    def terms(query):
+        return tokenizer.get_searchable_terms(tokenizer.scan(query))
+
+    # accents in both the term and the text are ignored
+    assert terms("nc:\u00fcb.r nc:u*r") == [
+        SearchTerm(r"u\p{M}*b\p{M}*\.\p{M}*r\p{M}*", None, SearchTermKind.REGEX),
+        SearchTerm(r"u\p{M}*[^\sr]*r\p{M}*", None, SearchTermKind.REGEX),
+    ]
+    assert terms("nc:* nc:") == []
+
+
+def test_word_terms(mock_skip_addon_init):
+
+    from highlight_search_results.search import (
+        SearchTerm,
+        SearchTermKind,
+        SearchTokenizer,
+        QueryLanguageVersion,
+    )
+
+    tokenizer = SearchTokenizer(QueryLanguageVersion.ANKI2124)
+
+    def terms(query):
+        return tokenizer.get_searchable_terms(tokenizer.scan(query))
+
+    # whole word searches apply to all fields, like plain terms
+    assert terms("w:dog w:do_ w:") == [
+        SearchTerm("dog"),
+        SearchTerm(r"do\S\p{M}*", None, SearchTermKind.REGEX),
+    ]
+
+    # older versions of the query language search the "w" field instead
+    legacy_tokenizer = SearchTokenizer(QueryLanguageVersion.ANKI2100)
+    assert legacy_tokenizer.get_searchable_terms(legacy_tokenizer.scan("w:x")) == [
+        SearchTerm("x", "w")
+    ]
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+# Highlight Search Results in the Browser Add-on for Anki
+#
+# Copyright (C) 2017-2020  Aristotelis P. <https://glutanimate.com/>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version, with the additions
+# listed at the end of the license file that accompanied this program.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# NOTE: This program is subject to certain additional terms pursuant to
+# Section 7 of the GNU Affero General Public License.  You should have
+# received a copy of these additional terms immediately following the
+# terms and conditions of the GNU Affero General Public License that
+# accompanied this program.
+#
+# If not, please request a copy through one of the means of contact
+# listed here: <https://glutanimate.com/contact/>.
+#
+# Any modifications to this file must keep this entire header intact.
+
+def test_highlight_service_notifies_subscribers(mock_skip_addon_init):
+
+    from highlight_search_results.service import HighlightService
+
+    service = HighlightService()
+    received = []
+    service.subscribe(received.append)
+
+    service.set_search("dog -cat")
+    assert [term.text for term in service.terms] == ["dog"]
+    assert received == [service.terms]
+
+    # queries are parsed once, and unchanged terms are not pushed again
+    service.set_search("dog -cat")
+    service.set_search("dog -mouse")
+    assert len(received) == 1
+    assert service.terms_cache.parser.misses == 2
+
+    service.clear()
+    assert service.terms == ()
+    assert received[-1] == ()
+
+    service.unsubscribe(received.append)
+    service.set_search("cat")
+    assert len(received) == 2
+
+
+def test_highlight_service_ignored_prefixes(mock_skip_addon_init):
+
+    from highlight_search_results.search import QueryLanguageVersion
+    from highlight_search_results.service import HighlightService
+
+    service = HighlightService()
+    service.register_ignored_search_prefix("myaddon:")
+    assert [term.text for term in service.get_terms("myaddon:x y")] == ["y"]
+
+    # kept when the tokenizer is swapped out
+    service.query_language_version = QueryLanguageVersion.ANKI2100
+    assert service.query_language_version == QueryLanguageVersion.ANKI2100
+    assert [term.text for term in service.get_terms("myaddon:x y")] == ["y"]
+    assert service.get_terms("") == ()